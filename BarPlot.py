@@ -0,0 +1,88 @@
+import numpy as np
+import pygame
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+
+
+class BarPlot:
+    """Matplotlib bar chart that is built once and rendered into a pygame surface.
+
+    The figure, axes, labels and bars are created in the constructor. update() only changes the
+    bar heights, and the figure is redrawn only when they changed: the static parts are drawn once
+    and cached, then the bars are blitted on top of that background.
+    """
+
+    def __init__(self, labels, figsize, title, color, xlabel=None, ylabel=None, ylim=None,
+                 title_fontsize=15, label_fontsize=10):
+        self.figure = Figure(figsize=figsize)
+        self.canvas = FigureCanvas(self.figure)
+        self.ax = self.figure.add_subplot()
+
+        # Animated artists are skipped by canvas.draw(), so the cached background has no bars
+        self.bars = self.ax.bar(range(len(labels)), np.zeros(len(labels)), color=color)
+        for bar in self.bars:
+            bar.set_animated(True)
+
+        self.ax.set_title(title, fontsize=title_fontsize)
+        if xlabel is not None:
+            self.ax.set_xlabel(xlabel)
+        if ylabel is not None:
+            self.ax.set_ylabel(ylabel)
+        self.ax.set_xticks(range(len(labels)))
+        self.ax.set_xticklabels(labels, rotation='vertical', fontsize=label_fontsize, ha='center')
+
+        # Without a fixed y range the axis grows with the data (e.g. histogram counts)
+        self.fixed_ylim = ylim is not None
+        self.ax.set_ylim(*(ylim if ylim is not None else (0, 1)))
+        self.figure.tight_layout()
+
+        self.values = None
+        self.background = None
+        self.surface = None
+        self.renderer = None
+
+    def get_width_height(self):
+        return self.canvas.get_width_height()
+
+    def update(self, values):
+        """Set the bar heights, returns True if the plot had to be redrawn."""
+        values = np.asarray(values, dtype=float)
+        if self.values is not None and np.array_equal(values, self.values):
+            return False
+        self.values = values.copy()
+
+        for bar, value in zip(self.bars, values):
+            bar.set_height(value)
+
+        full_redraw = self.background is None
+        if not self.fixed_ylim and len(values) > 0 and values.max() > self.ax.get_ylim()[1]:
+            # Leave some headroom so the axis does not have to be redrawn on every new count
+            self.ax.set_ylim(0, values.max() * 1.25)
+            full_redraw = True
+
+        if full_redraw:
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        else:
+            self.canvas.restore_region(self.background)
+        for bar in self.bars:
+            self.ax.draw_artist(bar)
+        self.canvas.blit(self.ax.bbox)
+
+        # The surface wraps the Agg buffer instead of copying it, so it follows every redraw and
+        # only has to be recreated when the canvas makes a new renderer (e.g. after a dpi change)
+        renderer = self.canvas.get_renderer()
+        if self.surface is None or renderer is not self.renderer:
+            self.surface = pygame.image.frombuffer(self.canvas.buffer_rgba(), self.get_width_height(), "RGBA")
+            self.renderer = renderer
+        return True
+
+    def get_surface(self):
+        """pygame surface with the last rendered plot."""
+        if self.surface is None:
+            self.update(np.zeros(len(self.bars)))
+        return self.surface
+
+    def save(self, filename):
+        """Save the plot with the current bar heights to an image file."""
+        self.figure.savefig(filename)
@@ -0,0 +1,79 @@
+import strawberryfields as sf
+from strawberryfields.ops import *
+from interferometer import mesh_layers
+from StageProfiler import profile_stage
+
+
+class CompiledFockProgram:
+    """Boson sampling program built once with free parameters and re-run on a persistent fock engine.
+
+    One program is compiled per photon placement (the input Fock states are not gate parameters),
+    the beamsplitter values are passed as arguments on every run.
+
+    The program has no rotation gates: a phase on a Fock input only changes the global phase, so
+    the probabilities do not depend on the angles. Symbolic gates are never skipped as identities
+    and a symbolic Rgate takes the slow generic path of the fock backend, with them a run took
+    about 4 times as long as a fresh program (190 ms against 50 ms for 4 channels and 3 photons).
+    """
+
+    def __init__(self, num_output_channels, dim, num_layers=None, profiler=None):
+        self.num_output_channels = num_output_channels
+        self.dim = dim
+        self.profiler = profiler  # Optional StageProfiler
+        self.layers = mesh_layers(num_output_channels, num_layers)
+        self.num_gates = sum(len(layer) for layer in self.layers)
+        self.engine = sf.Engine(backend='fock', backend_options={'cutoff_dim': dim})
+        self.programs = {}
+
+    def get_program(self, photon_placement):
+        """Return the compiled program for the photon placement, building it on first use."""
+        key = tuple(1 if i < len(photon_placement) and photon_placement[i] == 1 else 0
+                    for i in range(self.num_output_channels))
+        if key in self.programs:
+            return self.programs[key]
+
+        program = sf.Program(self.num_output_channels)
+        thetas = [program.params(f"theta_{k}") for k in range(self.num_gates)]
+        phis = [program.params(f"phi_{k}") for k in range(self.num_gates)]
+
+        with program.context as q:
+            # Prepare the input Fock states
+            for i in range(self.num_output_channels):
+                if key[i] == 1:
+                    Fock(1) | q[i]
+                else:
+                    Vac | q[i]
+
+            # Apply beamsplitter gates layer by layer
+            gate_index = 0
+            for layer in self.layers:
+                for i in layer:
+                    BSgate(thetas[gate_index], phis[gate_index]) | (q[i], q[i + 1])
+                    gate_index += 1
+
+        self.programs[key] = program.compile(compiler='fock')
+        return self.programs[key]
+
+    def get_args(self, gate_values):
+        """Values of the free parameters; missing gates are set to 0, which is the identity."""
+        args = {}
+        for k in range(self.num_gates):
+            theta, phi = gate_values[k] if k < len(gate_values) else (0, 0)
+            args[f"theta_{k}"] = theta
+            args[f"phi_{k}"] = phi
+        return args
+
+    def run(self, photon_placement, angle_first_rotation_gates, gate_values):
+        """Run the program for the photon placement and return the Fock probability tensor.
+
+        The rotation angles are accepted for the same signature as the setups and do not change the result.
+        """
+        with profile_stage(self.profiler, "build_program"):
+            program = self.get_program(photon_placement)
+        with profile_stage(self.profiler, "run_engine"):
+            # The engine keeps its state between runs, so start again from the vacuum
+            if self.engine.run_progs:
+                self.engine.reset()
+            results = self.engine.run(program, args=self.get_args(gate_values))
+        with profile_stage(self.profiler, "all_fock_probs"):
+            return results.state.all_fock_probs()
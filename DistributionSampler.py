@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class DistributionSampler:
+    """Draws measurement outcomes from a fixed probability distribution.
+
+    The cumulative distribution is built once per probability vector, after that every draw is a
+    binary search, so many samples can be taken in one call without re-validating the vector the
+    way np.random.choice does. The probabilities do not have to be normalised.
+    """
+
+    def __init__(self, probabilities):
+        probabilities = np.asarray(probabilities, dtype=float)
+        if probabilities.ndim != 1:
+            raise ValueError("probabilities must be a one-dimensional sequence")
+        if np.any(probabilities < 0):
+            raise ValueError("probabilities must be non-negative")
+        self.num_outcomes = len(probabilities)
+        total = probabilities.sum()
+        # An empty or all-zero distribution has nothing to sample
+        self.cumulative = None
+        if total > 0:
+            self.cumulative = np.cumsum(probabilities) / total
+            self.cumulative[-1] = 1.0  # Guard against rounding, every random number must fall inside
+
+    def is_empty(self):
+        return self.cumulative is None
+
+    def sample(self, num_samples=None):
+        """Index of one sampled outcome, or an array of num_samples indices. None if the distribution is empty."""
+        if self.cumulative is None:
+            return None
+        # side='right' skips outcomes with zero probability, their cumulative value equals the previous one
+        indices = np.searchsorted(self.cumulative, np.random.random(num_samples), side='right')
+        return int(indices) if num_samples is None else indices
+
+    def sample_counts(self, num_samples):
+        """Histogram of num_samples draws, the number of times each outcome was measured."""
+        if self.cumulative is None or num_samples <= 0:
+            return np.zeros(self.num_outcomes, dtype=int)
+        return np.bincount(self.sample(num_samples), minlength=self.num_outcomes)
@@ -1,21 +1,45 @@
+import logging
 import math
+import numpy as np
 import strawberryfields as sf
 from strawberryfields.ops import *
-import itertools
 import random
+from PermanentEngine import PermanentEngine
+from CompiledFockProgram import CompiledFockProgram
+from StageProfiler import profile_stage
+from ProbabilityCache import ProbabilityCache
+from output_states import output_state_tables, project_fock_probabilities
+from logger import get_logger, RateLimitFilter
+
+log = get_logger(__name__)
+log.addFilter(RateLimitFilter(1.0, level=logging.WARNING))  # A failing simulation would warn on every run
 
 
 class ExperimentalSetup:
 
-    def __init__(self, num_output_channels, num_photons, dim=-1):
+    # backend is either 'fock' (strawberryfields fock backend) or 'permanent' (PermanentEngine)
+    def __init__(self, num_output_channels, num_photons, dim=-1, backend='fock', cache_size=128,
+                 cache_tolerance=1e-6, reuse_program=False, profiler=None):
         self.num_output_channels = num_output_channels
         self.num_photons = num_photons
         if dim == -1:
             self.dim = num_photons + 1
-        else:
         else:
             self.dim = dim
-        self.boson_sampling = sf.Program(num_output_channels)
+        if backend not in ('fock', 'permanent'):
+            raise ValueError(f"Unknown backend {backend}, expected 'fock' or 'permanent'")
+        self.backend = backend
+        self.profiler = profiler  # Optional StageProfiler that records the time of every stage
+        # The beamsplitter ladder below has m + 1 layers
+        self.permanent_engine = PermanentEngine(num_output_channels, num_layers=num_output_channels + 1)
+        # State lists and flat indices only depend on (m, n, dim), so compute them once
+        self.output_tables = output_state_tables(num_output_channels, num_photons, self.dim)
+        self.probability_cache = ProbabilityCache(cache_size, cache_tolerance)
+        # With reuse_program the fock backend runs programs compiled once with free parameters on one engine
+        self.compiled_program = None
+        if reuse_program:
+            self.compiled_program = CompiledFockProgram(num_output_channels, self.dim,
+                                                        num_layers=num_output_channels + 1, profiler=profiler)
 
 
     # photonplacement should be in following style [1,1,1,1,0]
@@ -38,9 +62,9 @@ class ExperimentalSetup:
         if gate_values is None:
             gate_values = get_random_gate_values()
 
-        print(f"photon_placement: {photon_placement}")
-        print(f"angle_first_rotation_gates: {angle_first_rotation_gates}")
-        print(f"gate_values {gate_values}")
+        log.debug("photon_placement: %s", photon_placement)
+        log.debug("angle_first_rotation_gates: %s", angle_first_rotation_gates)
+        log.debug("gate_values %s", gate_values)
 
 
 
@@ -58,67 +82,91 @@ class ExperimentalSetup:
         if len(gate_values) < calculate_number_of_gates(len(photon_placement)):
             raise ValueError("Invalid number of gate values in gate_values")
 
+        # Reuse the probabilities of an earlier run with the same quantised parameters
+        with profile_stage(self.profiler, "cache_lookup"):
+            cache_key = self.probability_cache.make_key(photon_placement, gate_values)
+            cached_probabilities = self.probability_cache.get(cache_key)
+
         def get_all_possible_output_states_configurations():
-            states = []
-            for lost_photons in range(self.num_photons + 1):
-                remaining_photons = self.num_photons - lost_photons
-                for partition in itertools.product(range(remaining_photons + 1), repeat=self.num_output_channels):
-                    if sum(partition) == remaining_photons:
-                        states.append(list(partition))
-            return states
+            return [list(state) for state in self.output_tables.states]
 
-        def get_probability_of_output_states_configurations(experimental_probabilities, states):
-            final_probabilities = []
-            for i, state in enumerate(states):
-                final_probabilities.append(experimental_probabilities[*states[i]])
-            return final_probabilities
+        def get_probability_of_output_states_configurations(experimental_probabilities):
+            # Gather straight from the Fock tensor with the precomputed flat indices
+            final_probabilities = np.zeros(len(self.output_tables.states))
+            with profile_stage(self.profiler, "extraction"):
+                final_probabilities[self.output_tables.valid] = project_fock_probabilities(
+                    experimental_probabilities, self.output_tables.flat_indices)
+            return final_probabilities.tolist()
 
 
         def simulate():
-            with self.boson_sampling.context as q:
-                # Prepare the input Fock states
-                for i in range(len(photon_placement)):
-                    if photon_placement[i] == 1:
-                        Fock(1) | q[i]
-                        print(f"fock state {i}")
-                    else:
-                        Vac | q[i]
-                        print(f"empty state {i}")
-
-                # Apply the first rotation gates
-                for i in range(len(angle_first_rotation_gates)):
-                    Rgate(angle_first_rotation_gates[i]) | q[i]
-
-                # Apply the beamsplitter gates
-                i = 1
-                for j in range(len(photon_placement) + 1):
-                    if i % 2 != 0:
-                        ch = 0
-                        for bs_index in range(len(photon_placement)):
-                            gate_value = gate_values.pop(0)
-                            BSgate(gate_value[0], gate_value[1]) | (q[ch], q[ch + 1])
-                            ch += 2
-                            if ch + 1 >= len(photon_placement):
-                                break
-                        i += 1
-                    elif i % 2 == 0:
-                        ch = 0
-                        for bs_index in range(len(photon_placement)):
-                            gate_value = gate_values.pop(0)
-                            BSgate(gate_value[0], gate_value[1]) | (q[ch+1], q[ch + 2])
-                            ch = ch + 2
-                            if ch >= len(photon_placement) - 2:
-                                break
-                        i += 1
-
-                # initialise the engine
+            if self.compiled_program is not None:
+                # Re-run the program compiled for this photon placement with the new gate values
+                return self.compiled_program.run(photon_placement, angle_first_rotation_gates, gate_values)
+
+            # Create a new Program for each run, reusing one would keep appending gates to it
+            with profile_stage(self.profiler, "build_program"):
+                boson_sampling = sf.Program(self.num_output_channels)
+                with boson_sampling.context as q:
+                    # Prepare the input Fock states
+                    for i in range(len(photon_placement)):
+                        if photon_placement[i] == 1:
+                            Fock(1) | q[i]
+                            log.debug("fock state %d", i)
+                        else:
+                            Vac | q[i]
+                            log.debug("empty state %d", i)
+
+                    # Apply the first rotation gates
+                    for i in range(len(angle_first_rotation_gates)):
+                        Rgate(angle_first_rotation_gates[i]) | q[i]
+
+                    # Apply the beamsplitter gates
+                    i = 1
+                    for j in range(len(photon_placement) + 1):
+                        if i % 2 != 0:
+                            ch = 0
+                            for bs_index in range(len(photon_placement)):
+                                gate_value = gate_values.pop(0)
+                                BSgate(gate_value[0], gate_value[1]) | (q[ch], q[ch + 1])
+                                ch += 2
+                                if ch + 1 >= len(photon_placement):
+                                    break
+                            i += 1
+                        elif i % 2 == 0:
+                            ch = 0
+                            for bs_index in range(len(photon_placement)):
+                                gate_value = gate_values.pop(0)
+                                BSgate(gate_value[0], gate_value[1]) | (q[ch+1], q[ch + 2])
+                                ch = ch + 2
+                                if ch >= len(photon_placement) - 2:
+                                    break
+                            i += 1
+
+            # initialise the engine
+            with profile_stage(self.profiler, "run_engine"):
                 eng = sf.Engine(backend='fock', backend_options={'cutoff_dim': self.dim})
-                results = eng.run(self.boson_sampling)
+                results = eng.run(boson_sampling)
+            with profile_stage(self.profiler, "all_fock_probs"):
                 return results.state.all_fock_probs()
 
+        if cached_probabilities is not None:
+            return list(cached_probabilities), get_all_possible_output_states_configurations()
+
+        if self.backend == 'permanent':
+            out_put_states_configurations = get_all_possible_output_states_configurations()
+            with profile_stage(self.profiler, "build_unitary"):
+                unitary = self.permanent_engine.build_unitary(angle_first_rotation_gates, gate_values)
+            with profile_stage(self.profiler, "permanents"):
+                probabilities = self.permanent_engine.get_probabilities(photon_placement, unitary,
+                                                                        out_put_states_configurations)
+            self.probability_cache.put(cache_key, probabilities)
+            return probabilities.tolist(), out_put_states_configurations
+
         simulation_probabilities = simulate()
         out_put_states_configurations = get_all_possible_output_states_configurations()
-        probabilities = get_probability_of_output_states_configurations(simulation_probabilities, out_put_states_configurations)
+        probabilities = get_probability_of_output_states_configurations(simulation_probabilities)
+        self.probability_cache.put(cache_key, probabilities)
         return probabilities, out_put_states_configurations
 
 
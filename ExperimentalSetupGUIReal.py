@@ -1,62 +1,77 @@
+import logging
 import math
 import numpy as np
 import strawberryfields as sf
 from strawberryfields.ops import *
-import itertools
 import random
-from collections import defaultdict
+from PermanentEngine import PermanentEngine
+from CompiledFockProgram import CompiledFockProgram
+from StageProfiler import profile_stage
+from ProbabilityCache import ProbabilityCache
+from output_states import (output_state_tables, output_state_configurations, click_patterns,
+                           project_fock_probabilities)
+from logger import get_logger, RateLimitFilter
+
+log = get_logger(__name__)
+log.addFilter(RateLimitFilter(1.0, level=logging.WARNING))  # A failing simulation would warn on every run
 
 
 class ExperimentalSetupGUIReal:
-    def __init__(self, num_output_channels, num_photons, dim=-1):
+    def __init__(self, num_output_channels, num_photons, dim=-1, backend='fock', cache_size=128,
+                 cache_tolerance=1e-6, reuse_program=False, profiler=None):
         self.num_output_channels = num_output_channels
         self.num_photons = num_photons
         if dim == -1:
             self.dim = num_photons + 1
         else:
             self.dim = dim
+        # 'click' gives the on/off patterns of threshold detectors straight from the interferometer unitary
+        if backend not in ('fock', 'permanent', 'click'):
+            raise ValueError(f"Unknown backend {backend}, expected 'fock', 'permanent' or 'click'")
+        self.backend = backend
+        self.profiler = profiler  # Optional StageProfiler that records the time of every stage
+        self.permanent_engine = PermanentEngine(num_output_channels)
+        if backend == 'click':
+            # The click backend never needs the photon-number states, whose number grows quickly with n
+            self.output_tables = None
+            self.reduced_states = click_patterns(num_output_channels, num_photons)
+        else:
+            # State lists, flat indices and reduction groups only depend on (m, n, dim), so compute them once
+            self.output_tables = output_state_tables(num_output_channels, num_photons, self.dim)
+            self.reduced_states = self.output_tables.reduced_states
+        self.probability_cache = ProbabilityCache(cache_size, cache_tolerance)
+        # With reuse_program the fock backend runs programs compiled once with free parameters on one engine
+        self.compiled_program = (CompiledFockProgram(num_output_channels, self.dim, profiler=profiler)
+                                 if reuse_program else None)
+        num_ignored_states = 0 if self.output_tables is None else np.count_nonzero(~self.output_tables.valid)
+        if num_ignored_states:
+            log.warning("%d output states exceed the cutoff dimension %d and are ignored", num_ignored_states, self.dim)
 
     def get_all_possible_output_states_configurations(self):
-        states = []
-        # Iterate over possible numbers of lost photons (from 0 to num_photons)
-        for lost_photons in range(self.num_photons + 1):
-            remaining_photons = self.num_photons - lost_photons
-            # Generate all possible distributions of remaining photons across the output channels
-            for partition in itertools.product(range(remaining_photons + 1), repeat=self.num_output_channels):
-                if sum(partition) == remaining_photons:  # Only include states with the correct total photon count
-                    states.append(list(partition))
-        return states
+        # Every distribution of 0..num_photons photons over the output channels
+        if self.output_tables is None:
+            return [list(state) for state in output_state_configurations(self.num_output_channels, self.num_photons)]
+        return [list(state) for state in self.output_tables.states]
 
     def reduce_state(self, state):
         """Reduce a state to a configuration where each channel has at most one photon."""
         return tuple(min(1, photon_count) for photon_count in state)
 
-    def get_probability_of_output_states_configurations(self, experimental_probabilities, states):
-        reduced_probabilities = defaultdict(float)  # To store summed probabilities for each reduced state
-
-        for state in states:
-            try:
-                # Compute the flat index for the current state
-                index = np.ravel_multi_index(state, (self.dim,) * self.num_output_channels)
-                probability = experimental_probabilities[index]
-
-                # Reduce the state to the indistinguishable form and accumulate probability
-                reduced_state = self.reduce_state(state)
-                reduced_probabilities[reduced_state] += probability
-
-            except (IndexError, ValueError) as e:
-                print(f"Warning: State {state} - {e}")
+    def reduce_probabilities(self, state_probabilities):
+        """Sum the probabilities of the output states within the cutoff that reduce to the same configuration."""
+        with profile_stage(self.profiler, "reduction"):
+            reduced_probabilities = np.bincount(self.output_tables.reduction_groups, weights=state_probabilities,
+                                                minlength=len(self.output_tables.reduced_states))
+        return reduced_probabilities.tolist(), list(self.output_tables.reduced_states)
 
-        # Convert the reduced probabilities dictionary to separate lists for states and probabilities
-        final_states = list(reduced_probabilities.keys())
-        final_probabilities = list(reduced_probabilities.values())
-
-        return final_probabilities, final_states
+    def get_probability_of_output_states_configurations(self, experimental_probabilities):
+        """Gather the probabilities of the output states from the Fock probability tensor and reduce them."""
+        with profile_stage(self.profiler, "extraction"):
+            state_probabilities = project_fock_probabilities(experimental_probabilities,
+                                                             self.output_tables.flat_indices)
+        return self.reduce_probabilities(state_probabilities)
 
     def run_experiment(self, photon_placement, angle_first_rotation_gates=None, gate_values=None):
-        # Create a new Program instance for each run
-        boson_sampling = sf.Program(self.num_output_channels)
-
         def calculate_number_of_gates(n):
             return math.floor(n * n / 2)
 
@@ -67,21 +82,30 @@ class ExperimentalSetupGUIReal:
             gate_values = [(random.uniform(0, np.pi), random.uniform(0, np.pi))
                            for _ in range(calculate_number_of_gates(len(photon_placement)))]
 
-        print(f"photon_placement: {photon_placement}")
-        print(f"angle_first_rotation_gates: {angle_first_rotation_gates}")
-        print(f"gate_values {gate_values}")
-
-        def simulate():
-            try:
+        # Reuse the probabilities of an earlier run with the same quantised parameters
+        with profile_stage(self.profiler, "cache_lookup"):
+            cache_key = self.probability_cache.make_key(photon_placement, gate_values)
+            cached_probabilities = self.probability_cache.get(cache_key)
+        if cached_probabilities is not None:
+            return list(cached_probabilities), list(self.reduced_states)
+
+        log.debug("photon_placement: %s", photon_placement)
+        log.debug("angle_first_rotation_gates: %s", angle_first_rotation_gates)
+        log.debug("gate_values %s", gate_values)
+
+        def build_and_run_program():
+            # Create a new Program instance for each run
+            with profile_stage(self.profiler, "build_program"):
+                boson_sampling = sf.Program(self.num_output_channels)
                 with boson_sampling.context as q:
                     # Prepare the input Fock states
                     for i in range(self.num_output_channels):
                         if i < len(photon_placement) and photon_placement[i] == 1:
                             Fock(1) | q[i]
-                            print(f"fock state {i}")
+                            log.debug("fock state %d", i)
                         else:
                             Vac | q[i]
-                            print(f"empty state {i}")
+                            log.debug("empty state %d", i)
 
                     # Apply rotation gates
                     for i in range(min(len(angle_first_rotation_gates), len(q))):
@@ -95,35 +119,61 @@ class ExperimentalSetupGUIReal:
                                 gate_value = gate_values.pop(0)
                                 BSgate(gate_value[0], gate_value[1]) | (q[i], q[i + 1])
 
-                # Run the engine
+            # Run the engine
+            with profile_stage(self.profiler, "run_engine"):
                 eng = sf.Engine(backend='fock', backend_options={'cutoff_dim': self.dim})
                 results = eng.run(boson_sampling)
+            with profile_stage(self.profiler, "all_fock_probs"):
+                return results.state.all_fock_probs()
 
-                fock_probs = results.state.all_fock_probs()
-
-                # Flatten if needed
-                if fock_probs.ndim > 1:
-                    fock_probs = fock_probs.flatten()
-
-                if fock_probs.size == 0 or np.all(fock_probs == 0):
-                    print("Simulation returned an empty or zero-filled probability array.")
+        def simulate():
+            try:
+                if self.compiled_program is not None:
+                    # Re-run the program compiled for this photon placement with the new gate values
+                    fock_probs = self.compiled_program.run(photon_placement, angle_first_rotation_gates,
+                                                           gate_values)
+                else:
+                    fock_probs = build_and_run_program()
+
+                # The tensor is kept as it is, the output states are gathered from it without a flattened copy
+                if fock_probs.size == 0 or not fock_probs.any():
+                    log.warning("Simulation returned an empty or zero-filled probability array.")
                     return None
 
-                print(f"Simulation completed successfully. Probabilities length: {len(fock_probs)}")
+                log.debug("Simulation completed successfully. Probabilities length: %d", fock_probs.size)
                 return fock_probs
 
             except Exception as e:
-                print(f"Error during simulation: {e}")
+                log.error("Error during simulation: %s", e)
                 return None
 
+        if self.backend == 'permanent':
+            # Evaluate only the photon-number conserving states as permanents of the interferometer unitary
+            with profile_stage(self.profiler, "build_unitary"):
+                unitary = self.permanent_engine.build_unitary(angle_first_rotation_gates, gate_values)
+            with profile_stage(self.profiler, "permanents"):
+                state_probabilities = self.permanent_engine.get_probabilities(photon_placement, unitary,
+                                                                              self.output_tables.valid_states)
+            probabilities, final_states = self.reduce_probabilities(state_probabilities)
+            self.probability_cache.put(cache_key, probabilities)
+            return probabilities, final_states
+
+        if self.backend == 'click':
+            # Threshold detectors: every on/off pattern by inclusion-exclusion over sets of channels
+            with profile_stage(self.profiler, "build_unitary"):
+                unitary = self.permanent_engine.build_unitary(angle_first_rotation_gates, gate_values)
+            with profile_stage(self.profiler, "click_probabilities"):
+                probabilities = self.permanent_engine.get_click_probabilities(photon_placement, unitary,
+                                                                              self.reduced_states).tolist()
+            self.probability_cache.put(cache_key, probabilities)
+            return probabilities, list(self.reduced_states)
+
         simulation_probabilities = simulate()
         if simulation_probabilities is None:
-            print("Simulation failed or returned None. Returning placeholder values.")
+            log.warning("Simulation failed or returned None. Returning placeholder values.")
             return [], []  # Return empty lists instead of None to prevent unpacking issues
 
-        # Call the function to get output state configurations
-        output_states_configurations = self.get_all_possible_output_states_configurations()
-        probabilities, final_states = self.get_probability_of_output_states_configurations(simulation_probabilities,
-                                                                                           output_states_configurations)
+        probabilities, final_states = self.get_probability_of_output_states_configurations(simulation_probabilities)
+        self.probability_cache.put(cache_key, probabilities)
 
         return probabilities, final_states
\ No newline at end of file
@@ -0,0 +1,104 @@
+import numpy as np
+from interferometer import mesh_layers
+
+
+def apply_gate_to_rows(matrix, top, theta, phi):
+    """Multiply matrix in place from the left by BSgate(theta, phi) on channels (top, top + 1)."""
+    t = np.cos(theta)
+    r = np.sin(theta) * np.exp(1j * phi)
+    upper = matrix[top].copy()
+    matrix[top] = t * upper - np.conj(r) * matrix[top + 1]
+    matrix[top + 1] = r * upper + t * matrix[top + 1]
+
+
+def apply_gate_to_columns(matrix, top, theta, phi):
+    """Multiply matrix in place from the right by BSgate(theta, phi) on channels (top, top + 1)."""
+    t = np.cos(theta)
+    r = np.sin(theta) * np.exp(1j * phi)
+    left = matrix[:, top].copy()
+    matrix[:, top] = t * left + r * matrix[:, top + 1]
+    matrix[:, top + 1] = -np.conj(r) * left + t * matrix[:, top + 1]
+
+
+class IncrementalInterferometer:
+    """Mesh unitary that is updated incrementally when only a few gates change.
+
+    The unitary is U = G D with the gate product G = G_{K-1} ... G_0 and D the diagonal of the
+    first rotation gates. The prefix products P_k = G_{k-1} ... G_0 and suffix products
+    S_k = G_{K-1} ... G_k are kept between calls, so when the gates a..b changed
+    G = S_{b+1} (G_b ... G_a) P_a costs the changed gates plus one matrix product, instead of
+    re-applying the whole mesh. Only the products invalidated by a change are recomputed, and only
+    once they are needed. D only scales the columns of G, so new angles (the GUIs draw random ones
+    on every call) cost O(m^2) and leave the products valid.
+    """
+
+    def __init__(self, num_output_channels, num_layers=None):
+        self.num_output_channels = num_output_channels
+        self.gate_tops = np.concatenate([np.zeros(0, dtype=int)] + mesh_layers(num_output_channels, num_layers))
+        self.num_gates = len(self.gate_tops)
+        m = num_output_channels
+        self.prefix = np.zeros((self.num_gates + 1, m, m), dtype=complex)
+        self.suffix = np.zeros((self.num_gates + 1, m, m), dtype=complex)
+        self.prefix[0] = np.eye(m)
+        self.suffix[self.num_gates] = np.eye(m)
+        self.angles = None
+        self.gate_values = None
+        self.gate_unitary = np.eye(m, dtype=complex)  # G, the product of all gates without the rotations
+        self.unitary = None
+        self.prefix_valid = 0  # prefix[k] is up to date for k <= prefix_valid
+        self.suffix_valid = self.num_gates  # suffix[k] is up to date for k >= suffix_valid
+
+    def normalise(self, angle_first_rotation_gates, gate_values):
+        """Pad the parameters to full length, missing angles and gates are 0 (the identity)."""
+        angles = np.zeros(self.num_output_channels)
+        given_angles = np.asarray(angle_first_rotation_gates, dtype=float).reshape(-1)[:self.num_output_channels]
+        angles[:len(given_angles)] = given_angles
+        values = np.zeros((self.num_gates, 2))
+        given_values = np.asarray(gate_values, dtype=float).reshape(-1, 2)[:self.num_gates]
+        values[:len(given_values)] = given_values
+        return angles, values
+
+    def extend_prefix(self, k):
+        while self.prefix_valid < k:
+            i = self.prefix_valid
+            self.prefix[i + 1] = self.prefix[i]
+            apply_gate_to_rows(self.prefix[i + 1], self.gate_tops[i], *self.gate_values[i])
+            self.prefix_valid += 1
+
+    def extend_suffix(self, k):
+        while self.suffix_valid > k:
+            i = self.suffix_valid - 1
+            self.suffix[i] = self.suffix[i + 1]
+            apply_gate_to_columns(self.suffix[i], self.gate_tops[i], *self.gate_values[i])
+            self.suffix_valid -= 1
+
+    def update(self, angle_first_rotation_gates, gate_values):
+        """Return the unitary for the new parameters, reusing the products of the unchanged gates."""
+        angles, values = self.normalise(angle_first_rotation_gates, gate_values)
+        if self.gate_values is None:
+            changed = np.arange(self.num_gates)
+        else:
+            changed = np.flatnonzero(np.any(values != self.gate_values, axis=1))
+
+        if len(changed) > 0:
+            first, last = changed[0], changed[-1]
+            # The products around the changed range are built from the gates that did not change
+            self.extend_prefix(first)
+            self.extend_suffix(last + 1)
+
+            middle = self.prefix[first].copy()
+            for i in range(first, last + 1):
+                apply_gate_to_rows(middle, self.gate_tops[i], *values[i])
+            self.gate_unitary = middle if last + 1 == self.num_gates else self.suffix[last + 1] @ middle
+
+            # Products that contain one of the changed gates are stale now
+            self.prefix_valid = min(self.prefix_valid, first)
+            self.suffix_valid = max(self.suffix_valid, last + 1)
+        elif self.unitary is not None and np.array_equal(angles, self.angles):
+            return self.unitary
+        self.gate_values = values
+
+        # The rotations act first, so G D multiplies column j of G by e^{i angle_j}
+        self.angles = angles
+        self.unitary = self.gate_unitary * np.exp(1j * angles)
+        return self.unitary
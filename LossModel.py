@@ -0,0 +1,63 @@
+import itertools
+import numpy as np
+
+
+class LossModel:
+    """Photon loss at the sources, with one efficiency per channel.
+
+    Each input photon survives independently with the efficiency of its channel. thin() draws one
+    random loss pattern like a single run of the experiment, mix() gives the exact lossy output
+    distribution by weighting the distribution of every surviving subset of the input photons.
+    """
+
+    def __init__(self, num_output_channels, efficiency):
+        efficiencies = np.broadcast_to(np.asarray(efficiency, dtype=float), (num_output_channels,))
+        if np.any(efficiencies < 0) or np.any(efficiencies > 1):
+            raise ValueError("efficiency must be between 0 and 1")
+        self.num_output_channels = num_output_channels
+        self.efficiencies = efficiencies.copy()
+
+    def input_channels(self, photon_placement):
+        return [i for i in range(min(len(photon_placement), self.num_output_channels)) if photon_placement[i] == 1]
+
+    def thin(self, photon_placement):
+        """Remove each photon of the placement with probability 1 - efficiency of its channel."""
+        placement = list(photon_placement)
+        channels = self.input_channels(placement)
+        lost = np.random.random(len(channels)) >= self.efficiencies[channels]
+        for i in np.array(channels, dtype=int)[lost]:
+            placement[i] = 0
+        return placement
+
+    def loss_patterns(self, photon_placement):
+        """List of (surviving placement, probability) for every subset of input photons that can survive."""
+        channels = self.input_channels(photon_placement)
+        # One row per subset, 1 where the photon of that input channel survives
+        survived = np.array(list(itertools.product((1, 0), repeat=len(channels))), dtype=int).reshape(-1, len(channels))
+        efficiencies = self.efficiencies[channels]
+        weights = np.prod(np.where(survived == 1, efficiencies, 1 - efficiencies), axis=1)
+
+        patterns = []
+        for row, weight in zip(survived, weights):
+            if weight == 0:
+                continue
+            placement = list(photon_placement)
+            for i, kept in zip(channels, row):
+                placement[i] = int(kept)
+            patterns.append((placement, weight))
+        return patterns
+
+    def mix(self, photon_placement, get_probabilities):
+        """Exact lossy distribution, the sum of get_probabilities(placement) weighted over all loss patterns.
+
+        get_probabilities is called once per surviving subset and may return None if a simulation
+        failed, in which case mix() returns None as well.
+        """
+        mixed = None
+        for placement, weight in self.loss_patterns(photon_placement):
+            probabilities = get_probabilities(placement)
+            if probabilities is None:
+                return None
+            weighted = weight * np.asarray(probabilities, dtype=float)
+            mixed = weighted if mixed is None else mixed + weighted
+        return mixed
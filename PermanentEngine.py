@@ -0,0 +1,100 @@
+import itertools
+import math
+import numpy as np
+from thewalrus import perm
+from IncrementalInterferometer import IncrementalInterferometer
+
+
+class PermanentEngine:
+    """Boson sampling engine that computes output probabilities as matrix permanents.
+
+    Instead of simulating the full Fock space like the strawberryfields fock backend,
+    the interferometer is reduced to its m x m unitary and only the photon-number
+    conserving output states are evaluated.
+    """
+
+    def __init__(self, num_output_channels, num_layers=None):
+        self.num_output_channels = num_output_channels
+        # The GUI setups use m beamsplitter layers, ExperimentalSetup uses m + 1
+        self.num_layers = num_output_channels if num_layers is None else num_layers
+        # Keeps partial products of the mesh, so moving one slider only recomputes that gate
+        self.interferometer = IncrementalInterferometer(num_output_channels, self.num_layers)
+        self.subsets = {}  # Number of channels -> (bit masks, indicator matrix) of every subset of that size
+
+    def build_unitary(self, angle_first_rotation_gates, gate_values):
+        """Build the interferometer unitary with the same mesh as the strawberryfields programs.
+
+        The returned array is reused by later calls and must not be modified.
+        """
+        return self.interferometer.update(angle_first_rotation_gates, gate_values)
+
+    def get_probabilities(self, photon_placement, unitary, states):
+        """Probability of each output state for single photons entering the channels marked with 1."""
+        input_channels = [i for i in range(self.num_output_channels)
+                          if i < len(photon_placement) and photon_placement[i] == 1]
+        num_input_photons = len(input_channels)
+
+        probabilities = np.zeros(len(states))
+        for index, state in enumerate(states):
+            # Linear optics conserves the photon number, every other state has probability zero
+            if sum(state) != num_input_photons:
+                continue
+            if num_input_photons == 0:
+                probabilities[index] = 1.0
+                continue
+
+            # Output channel k appears state[k] times in the rows of the submatrix
+            rows = np.repeat(np.arange(self.num_output_channels), state)
+            submatrix = unitary[np.ix_(rows, input_channels)]
+            normalisation = math.prod(math.factorial(photon_count) for photon_count in state)
+            probabilities[index] = abs(perm(submatrix)) ** 2 / normalisation
+
+        return probabilities
+
+    def get_subsets(self, size):
+        """Bit masks and a (subsets, m) indicator matrix of every set of size output channels."""
+        if size not in self.subsets:
+            channels = np.array(list(itertools.combinations(range(self.num_output_channels), size)), dtype=int)
+            indicator = np.zeros((len(channels), self.num_output_channels))
+            np.put_along_axis(indicator, channels, 1, axis=1)
+            masks = (indicator @ (1 << np.arange(self.num_output_channels))).astype(np.int64)
+            self.subsets[size] = (masks, indicator)
+        return self.subsets[size]
+
+    def get_click_probabilities(self, photon_placement, unitary, patterns):
+        """Probability of each on/off detector pattern (rows of 0 and 1) for threshold detectors.
+
+        The probability that every photon ends up in a set of channels B is the permanent of the
+        n x n Gram matrix of the rows of B, restricted to the input columns. The probability that
+        exactly the channels of C click follows by inclusion-exclusion over the subsets of C, so
+        no photon-number state with several photons in one channel is ever evaluated.
+        """
+        input_channels = [i for i in range(self.num_output_channels)
+                          if i < len(photon_placement) and photon_placement[i] == 1]
+        num_input_photons = len(input_channels)
+        patterns = np.asarray(patterns, dtype=np.int64).reshape(-1, self.num_output_channels)
+        pattern_masks = patterns @ (1 << np.arange(self.num_output_channels))
+        num_clicks = patterns.sum(axis=1)
+        if num_input_photons == 0:
+            return (num_clicks == 0).astype(float)
+
+        # Probability that all photons land inside each set of at most n channels, indexed by bit mask.
+        # The Gram matrix of a set is the sum of the outer products of its rows
+        columns = unitary[:, input_channels]
+        row_products = np.einsum('ki,kj->kij', columns.conj(), columns).reshape(self.num_output_channels, -1)
+        all_inside = np.zeros(1 << self.num_output_channels)
+        for size in range(1, min(num_input_photons, self.num_output_channels) + 1):
+            masks, indicator = self.get_subsets(size)
+            grams = (indicator @ row_products).reshape(-1, num_input_photons, num_input_photons)
+            all_inside[masks] = [perm(gram).real for gram in grams]
+
+        # Moebius transform over the subset lattice: P(exactly C) = sum over B in C of (-1)^|C - B| P(inside B).
+        # Sets with more than n channels are left at 0, they only affect patterns that cannot occur
+        all_masks = np.arange(1 << self.num_output_channels)
+        for channel in range(self.num_output_channels):
+            with_channel = all_masks[(all_masks >> channel) & 1 == 1]
+            all_inside[with_channel] -= all_inside[with_channel ^ (1 << channel)]
+
+        probabilities = np.where(num_clicks <= num_input_photons, all_inside[pattern_masks], 0.0)
+        # Remove the rounding noise of the alternating sums
+        return np.clip(probabilities, 0.0, None)
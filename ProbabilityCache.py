@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+
+class ProbabilityCache:
+    """Least recently used cache of output probabilities keyed on quantised gate parameters.
+
+    Parameters closer together than the tolerance share a key, so a slider that is not being
+    dragged (or is moved back to an earlier position) never triggers a new simulation.
+    """
+
+    def __init__(self, max_size=128, tolerance=1e-6):
+        if tolerance <= 0:
+            raise ValueError("tolerance must be positive")
+        self.max_size = max_size  # 0 disables the cache
+        self.tolerance = tolerance
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def quantise(self, value):
+        return round(float(value) / self.tolerance)
+
+    def make_key(self, photon_placement, gate_values):
+        # The rotation angles are left out: a phase on a single-photon Fock input only changes the
+        # global phase of the output amplitudes, so the probabilities do not depend on it. The GUIs
+        # also draw new random angles on every call, which would make every key different
+        return (tuple(photon_placement),
+                tuple((self.quantise(theta), self.quantise(phi)) for theta, phi in gate_values))
+
+    def get(self, key):
+        """Return the cached probabilities for key, or None on a miss."""
+        if self.max_size <= 0:
+            return None
+        probabilities = self.entries.get(key)
+        if probabilities is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return probabilities
+
+    def put(self, key, probabilities):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = tuple(probabilities)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
+
+    def __repr__(self):
+        return (f"ProbabilityCache(size={len(self.entries)}, max_size={self.max_size}, "
+                f"hits={self.hits}, misses={self.misses})")
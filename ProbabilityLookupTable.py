@@ -0,0 +1,196 @@
+import argparse
+import itertools
+import time
+import numpy as np
+from ExperimentalSetupGUIReal import ExperimentalSetupGUIReal
+from interferometer import calculate_number_of_gates
+
+# A lookup table is stored as two files next to each other: <name>.npy holds the reduced output
+# probabilities for every point of the parameter grid with shape (*grid shape, number of states),
+# <name>.npz holds the grid axes, the photon placement and the reduced output states.
+# The parameters are the gate values flattened as theta_0, phi_0, theta_1, phi_1, ...
+# The .npz also holds max_error and mean_error, the largest and mean absolute difference between
+# the interpolated and the simulated probabilities at random points between the grid points.
+
+
+def build_lookup_table(filename, num_output_channels, num_photons, photon_placement, grids, backend='permanent',
+                       dtype=np.float32, num_check_points=200, max_error=0.01, seed=None):
+    """Sweep ExperimentalSetupGUIReal over the grid of gate values and store the distributions.
+
+    grids is either one array of values used for every gate parameter or a list with one array per
+    parameter (2 per gate). The rotation angles are set to 0, a phase on a Fock input state does
+    not change the output probabilities.
+
+    Afterwards the table is compared with the simulation at num_check_points random points inside
+    the grid, the interpolation error is stored with the table and a warning is printed if it is
+    above max_error. Returns the largest error.
+    """
+    num_gates = calculate_number_of_gates(num_output_channels)
+    num_parameters = 2 * num_gates
+    if len(grids) > 0 and np.ndim(grids[0]) == 0:
+        grids = [grids] * num_parameters
+    grids = [np.asarray(grid, dtype=float) for grid in grids]
+    if len(grids) != num_parameters:
+        raise ValueError(f"Expected {num_parameters} grids (theta and phi for {num_gates} gates), got {len(grids)}")
+    for grid in grids:
+        if grid.ndim != 1 or len(grid) == 0 or np.any(np.diff(grid) <= 0):
+            raise ValueError("Every grid must be a non-empty increasing sequence of values")
+
+    exp_setup = ExperimentalSetupGUIReal(num_output_channels, num_photons, backend=backend, cache_size=0)
+    reduced_states = np.array(exp_setup.reduced_states, dtype=int)
+    shape = tuple(len(grid) for grid in grids)
+    table = np.lib.format.open_memmap(filename + ".npy", mode='w+', dtype=dtype,
+                                      shape=shape + (len(reduced_states),))
+
+    num_points = int(np.prod(shape))
+    print(f"Building lookup table with {num_points} grid points for {len(reduced_states)} output states")
+    start_time = time.time()
+    angles = [0] * num_output_channels
+    for count, index in enumerate(itertools.product(*(range(n) for n in shape))):
+        parameters = [grid[i] for grid, i in zip(grids, index)]
+        gate_values = list(zip(parameters[0::2], parameters[1::2]))
+        probabilities, _ = exp_setup.run_experiment(photon_placement, angles, gate_values)
+        if len(probabilities) == 0:
+            raise RuntimeError(f"Simulation failed for gate values {gate_values}")
+        table[index] = probabilities
+        if (count + 1) % 10000 == 0:
+            print(f"{count + 1}/{num_points} points, {time.time() - start_time:.0f} s")
+    table.flush()
+
+    errors = check_interpolation_error(exp_setup, table, grids, photon_placement, num_check_points, seed)
+    # nan when no points were checked, the table is then refused by ProbabilityLookupTable(max_error=...)
+    error = errors.max() if len(errors) else np.nan
+    np.savez(filename + ".npz", num_output_channels=num_output_channels, num_photons=num_photons,
+             photon_placement=np.asarray(photon_placement, dtype=int), reduced_states=reduced_states,
+             max_error=error, mean_error=errors.mean() if len(errors) else np.nan,
+             **{f"grid_{i}": grid for i, grid in enumerate(grids)})
+    print(f"Saved lookup table to {filename}.npy and {filename}.npz in {time.time() - start_time:.0f} s")
+    print(f"Interpolation error at {len(errors)} random points: max {error:.4f}, mean {errors.mean():.4f}"
+          if len(errors) else "Interpolation error not checked")
+    if error > max_error:
+        print(f"WARNING: the interpolation error {error:.4f} is above {max_error}, the grid is too coarse "
+              f"for these gate values. Use more grid points or run the simulation directly")
+    return error
+
+
+def check_interpolation_error(exp_setup, table, grids, photon_placement, num_points, seed=None):
+    """Largest absolute probability error of the interpolated table at random points inside the grid."""
+    corners = cell_corners(len(grids))
+    rng = np.random.default_rng(seed)
+    angles = [0] * exp_setup.num_output_channels
+    errors = np.zeros(num_points)
+    for i in range(num_points):
+        parameters = [rng.uniform(grid[0], grid[-1]) for grid in grids]
+        gate_values = list(zip(parameters[0::2], parameters[1::2]))
+        probabilities, _ = exp_setup.run_experiment(photon_placement, angles, gate_values)
+        errors[i] = np.max(np.abs(interpolate(table, grids, corners, gate_values) - probabilities))
+    return errors
+
+
+def cell_corners(num_parameters):
+    # Offsets of the 2^P corners of a grid cell
+    return np.array(list(itertools.product((0, 1), repeat=num_parameters)), dtype=int)
+
+
+def interpolate(table, grids, corners, gate_values):
+    """Multilinear interpolation of the table at the gate values.
+
+    Missing gates are set to 0 and values outside the grid are clamped to its edges.
+    """
+    parameters = np.zeros(len(grids))
+    flat_values = np.asarray(gate_values, dtype=float).reshape(-1)[:len(grids)]
+    parameters[:len(flat_values)] = flat_values
+
+    lower = np.zeros(len(grids), dtype=int)
+    upper = np.zeros(len(grids), dtype=int)
+    fraction = np.zeros(len(grids))
+    for i, (grid, value) in enumerate(zip(grids, parameters)):
+        if len(grid) == 1:
+            continue  # Nothing to interpolate along this parameter
+        value = min(max(value, grid[0]), grid[-1])
+        lower[i] = min(np.searchsorted(grid, value, side='right') - 1, len(grid) - 2)
+        upper[i] = lower[i] + 1
+        fraction[i] = (value - grid[lower[i]]) / (grid[upper[i]] - grid[lower[i]])
+
+    # Weight of each corner is the product of fraction or 1 - fraction along every parameter
+    indices = np.where(corners == 1, upper, lower)
+    weights = np.prod(np.where(corners == 1, fraction, 1 - fraction), axis=1)
+    used = weights > 0
+    values = table[tuple(indices[used].T)]
+    return weights[used] @ values
+
+
+class ProbabilityLookupTable:
+    """Output distributions interpolated from a table built by build_lookup_table.
+
+    The table is memory-mapped, so only the grid cells around the requested parameters are read.
+    run_experiment has the same signature and return value as ExperimentalSetupGUIReal, so it can
+    replace the setup in the GUIs.
+
+    The interpolation is only as good as the grid: max_error is the error measured when the table
+    was built. Passing max_error refuses tables with a larger (or unknown) error.
+    """
+
+    def __init__(self, filename, max_error=None):
+        with np.load(filename + ".npz") as metadata:
+            self.num_output_channels = int(metadata["num_output_channels"])
+            self.num_photons = int(metadata["num_photons"])
+            self.photon_placement = metadata["photon_placement"].tolist()
+            self.reduced_states = [tuple(state) for state in metadata["reduced_states"].tolist()]
+            num_parameters = 2 * calculate_number_of_gates(self.num_output_channels)
+            self.grids = [metadata[f"grid_{i}"] for i in range(num_parameters)]
+            # Tables built before the error was checked have none stored
+            self.max_error = float(metadata["max_error"]) if "max_error" in metadata else np.nan
+            self.mean_error = float(metadata["mean_error"]) if "mean_error" in metadata else np.nan
+        if max_error is not None and not self.max_error <= max_error:
+            raise ValueError(f"Lookup table {filename} has an interpolation error of {self.max_error:.4f}, "
+                             f"above the allowed {max_error}")
+        self.table = np.load(filename + ".npy", mmap_mode='r')
+        self.corners = cell_corners(len(self.grids))
+
+    def lookup(self, gate_values):
+        """Multilinear interpolation of the reduced output probabilities at the gate values.
+
+        Missing gates are set to 0 and values outside the grid are clamped to its edges.
+        """
+        return interpolate(self.table, self.grids, self.corners, gate_values)
+
+    def run_experiment(self, photon_placement, angle_first_rotation_gates=None, gate_values=None):
+        if list(photon_placement) != self.photon_placement:
+            raise ValueError(f"Lookup table was built for photon placement {self.photon_placement}, "
+                             f"not {list(photon_placement)}")
+        probabilities = self.lookup(gate_values if gate_values is not None else [])
+        return probabilities.tolist(), list(self.reduced_states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a lookup table of output distributions over a grid of gate values.")
+    parser.add_argument("filename", help="output path without extension, writes <filename>.npy and <filename>.npz")
+    parser.add_argument("--channels", type=int, default=4, help="number of output channels")
+    parser.add_argument("--photons", type=int, default=3, help="number of photons")
+    parser.add_argument("--input-state", default="1,1,1,0", help="comma separated photon placement")
+    parser.add_argument("--points", type=int, default=3,
+                        help="grid points per theta parameter. The error falls slowly with the density, e.g. for "
+                             "3 channels and 2 photons 3 points give a max error of 0.5, 5 give 0.26 and 9 give "
+                             "0.08, while the table grows as points^(2 * gates)")
+    parser.add_argument("--phi-points", type=int, default=None, help="grid points per phi parameter (default: --points)")
+    parser.add_argument("--max-value", type=float, default=np.pi / 2, help="upper end of the slider range")
+    parser.add_argument("--backend", default="permanent", choices=["permanent", "fock", "click"])
+    parser.add_argument("--check-points", type=int, default=200,
+                        help="random points at which the interpolation is compared with the simulation")
+    parser.add_argument("--max-error", type=float, default=0.01, help="warn above this interpolation error")
+    args = parser.parse_args()
+
+    photon_placement = [int(photon) for photon in args.input_state.split(",")]
+    phi_points = args.phi_points if args.phi_points is not None else args.points
+    num_gates = calculate_number_of_gates(args.channels)
+    grids = []
+    for _ in range(num_gates):
+        grids.append(np.linspace(0, args.max_value, args.points))
+        grids.append(np.linspace(0, args.max_value, phi_points))
+    build_lookup_table(args.filename, args.channels, args.photons, photon_placement, grids, backend=args.backend,
+                       num_check_points=args.check_points, max_error=args.max_error)
+
+
+if __name__ == "__main__":
+    main()
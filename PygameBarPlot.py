@@ -0,0 +1,141 @@
+import math
+import numpy as np
+import pygame
+from matplotlib.colors import to_rgb
+
+
+def tick_values(top, max_ticks=6):
+    """Evenly spaced y-axis ticks from 0 to top with a 1, 2, 2.5 or 5 times a power of ten step."""
+    if top <= 0:
+        return [0]
+    raw_step = top / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for step in (1, 2, 2.5, 5, 10):
+        if step * magnitude >= raw_step:
+            break
+    step *= magnitude
+    return [i * step for i in range(int(top / step + 1e-9) + 1)]
+
+
+class PygameBarPlot:
+    """Bar chart drawn directly with pygame primitives, a drop-in replacement for BarPlot.
+
+    Takes the same arguments as BarPlot (the figure size is in inches at the given dpi, the font
+    sizes in points) but never rasterises a matplotlib figure. Every piece of text is rendered
+    once and cached, so an update only fills rectangles and blits the cached label surfaces.
+    """
+
+    def __init__(self, labels, figsize, title, color, xlabel=None, ylabel=None, ylim=None,
+                 title_fontsize=15, label_fontsize=10, dpi=100):
+        if not pygame.font.get_init():
+            pygame.font.init()
+        self.size = (int(figsize[0] * dpi), int(figsize[1] * dpi))
+        self.color = tuple(int(255 * c) for c in to_rgb(color))
+        self.num_bars = len(labels)
+
+        # pygame font sizes are in pixels, matplotlib font sizes in points
+        def make_font(points):
+            return pygame.font.Font(None, max(1, int(round(points * dpi / 72 * 1.4))))
+        self.font = make_font(10)
+        title_font = make_font(title_fontsize)
+        label_font = make_font(label_fontsize)
+
+        # Static text is rendered once, the tick labels of the x axis are rotated like in BarPlot
+        self.title_surfaces = [title_font.render(line.strip(), True, (0, 0, 0)) for line in title.split("\n")]
+        self.label_surfaces = [pygame.transform.rotate(label_font.render(str(label), True, (0, 0, 0)), 90)
+                               for label in labels]
+        self.xlabel_surface = None if xlabel is None else self.font.render(xlabel, True, (0, 0, 0))
+        self.ylabel_surface = (None if ylabel is None else
+                               pygame.transform.rotate(self.font.render(ylabel, True, (0, 0, 0)), 90))
+        self.tick_text_cache = {}
+
+        # Without a fixed y range the axis grows with the data (e.g. histogram counts)
+        self.fixed_ylim = ylim is not None
+        self.ylim = tuple(ylim) if ylim is not None else (0, 1)
+
+        self.values = None
+        self.surface = pygame.Surface(self.size)
+
+    def get_width_height(self):
+        return self.size
+
+    def get_tick_text(self, value):
+        """Cached surface with the label of a y-axis tick."""
+        text = f"{value:g}"
+        if text not in self.tick_text_cache:
+            self.tick_text_cache[text] = self.font.render(text, True, (0, 0, 0))
+        return self.tick_text_cache[text]
+
+    def update(self, values):
+        """Set the bar heights, returns True if the plot had to be redrawn."""
+        values = np.asarray(values, dtype=float)
+        if self.values is not None and np.array_equal(values, self.values):
+            return False
+        self.values = values.copy()
+
+        if not self.fixed_ylim and len(values) > 0 and values.max() > self.ylim[1]:
+            # Leave some headroom so the axis does not have to change on every new count
+            self.ylim = (0, values.max() * 1.25)
+
+        self.draw()
+        return True
+
+    def draw(self):
+        width, height = self.size
+        padding = 6
+        surface = self.surface
+        surface.fill((255, 255, 255))
+
+        # Title at the top
+        y = padding
+        for line in self.title_surfaces:
+            surface.blit(line, ((width - line.get_width()) // 2, y))
+            y += line.get_height()
+        top = y + padding
+
+        # Reserve room for the y-axis label and tick labels on the left, the x-axis labels at the bottom
+        ticks = [tick for tick in tick_values(self.ylim[1] - self.ylim[0]) if tick + self.ylim[0] <= self.ylim[1]]
+        tick_surfaces = [self.get_tick_text(tick + self.ylim[0]) for tick in ticks]
+        left = padding + max((text.get_width() for text in tick_surfaces), default=0) + padding
+        if self.ylabel_surface is not None:
+            left += self.ylabel_surface.get_width() + padding
+        bottom = height - padding - max((label.get_height() for label in self.label_surfaces), default=0) - padding
+        if self.xlabel_surface is not None:
+            bottom -= self.xlabel_surface.get_height() + padding
+        right = width - 2 * padding
+        plot_height = max(1, bottom - top)
+        plot_width = max(1, right - left)
+
+        def to_y(value):
+            fraction = (value - self.ylim[0]) / (self.ylim[1] - self.ylim[0])
+            return bottom - min(max(fraction, 0), 1) * plot_height
+
+        # Y-axis ticks and labels
+        for tick, text in zip(ticks, tick_surfaces):
+            tick_y = int(to_y(tick + self.ylim[0]))
+            pygame.draw.line(surface, (0, 0, 0), (left - 4, tick_y), (left, tick_y))
+            surface.blit(text, (left - 6 - text.get_width(), tick_y - text.get_height() // 2))
+        if self.ylabel_surface is not None:
+            surface.blit(self.ylabel_surface, (padding, top + (plot_height - self.ylabel_surface.get_height()) // 2))
+
+        # Bars with the x-axis labels underneath, 0.8 of the slot like matplotlib
+        slot = plot_width / max(self.num_bars, 1)
+        values = self.values if self.values is not None else np.zeros(self.num_bars)
+        for i, (value, label) in enumerate(zip(values, self.label_surfaces)):
+            center = left + (i + 0.5) * slot
+            bar_top = to_y(value)
+            bar = pygame.Rect(int(center - 0.4 * slot), int(bar_top), max(1, int(0.8 * slot)), int(round(bottom - bar_top)))
+            pygame.draw.rect(surface, self.color, bar)
+            surface.blit(label, (int(center - label.get_width() / 2), bottom + padding))
+        if self.xlabel_surface is not None:
+            surface.blit(self.xlabel_surface, (left + (plot_width - self.xlabel_surface.get_width()) // 2,
+                                               height - padding - self.xlabel_surface.get_height()))
+
+        # Axes frame
+        pygame.draw.rect(surface, (0, 0, 0), (left, top, plot_width + 1, plot_height + 1), 1)
+
+    def get_surface(self):
+        """pygame surface with the last rendered plot."""
+        if self.values is None:
+            self.update(np.zeros(self.num_bars))
+        return self.surface
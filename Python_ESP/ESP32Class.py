@@ -1,22 +1,37 @@
 import math
 
+# Kinds of optical element an ESP can control:
+#   beamsplitter        one pot for the transmission
+#   phase_beamsplitter  a beamsplitter with a phase shifter on its second input (second pot)
+#   mach_zehnder        the transmission of the first stage comes from the input brightness, the
+#                       pots set the second beamsplitter and the phase shifters on both arms
+NODE_TYPES = ("beamsplitter", "phase_beamsplitter", "mach_zehnder")
+# Type of the boards of the original six-ESP installation, by id
+DEFAULT_NODE_TYPES = {3: "phase_beamsplitter", 4: "mach_zehnder"}
+
+
 class ESPLED:
-    def __init__(self, ip, id, pot_value, pot_value_ps_1=None, pot_value_ps_2=None):
+    def __init__(self, ip, id, pot_value, pot_value_ps_1=None, pot_value_ps_2=None, node_type=None):
         """
         Initialize an ESP device.
 
         :param id: Unique ID for the ESP device
         :param ip: Unique IP for the ESP device
-        :param brightness: Brightness level
-        :param led_strips: List of tuples (strip_id, led_count, led_output_id) for each of the 4 LED strips
+        :param pot_value: Value of the transmission pot (0 - 4095)
+        :param pot_value_ps_1: Value of the first phase shifter pot, used by phase_beamsplitter and mach_zehnder
+        :param pot_value_ps_2: Value of the second phase shifter pot, used by mach_zehnder
+        :param node_type: One of NODE_TYPES, by default taken from DEFAULT_NODE_TYPES
         """
         self.ip = ip
         self.id = id
+        self.node_type = DEFAULT_NODE_TYPES.get(id, "beamsplitter") if node_type is None else node_type
+        if self.node_type not in NODE_TYPES:
+            raise ValueError(f"Unknown node type {self.node_type}, expected one of {NODE_TYPES}")
         self.pot_value = pot_value
-        # Only initialize these variables if self.id == 4
-        if self.id == 3:
+        # Only initialize the phase shifter pots the node type has
+        if self.node_type == "phase_beamsplitter":
             self.pot_value_ps_1 = pot_value_ps_1
-        elif self.id == 4:
+        elif self.node_type == "mach_zehnder":
             self.pot_value_ps_1 = pot_value_ps_1
             self.pot_value_ps_2 = pot_value_ps_2
         
@@ -24,7 +39,21 @@ class ESPLED:
         self.output_brightness_1 = 0
         self.output_brightness_2 = 0
         self.entanglement = 0
-    
+
+    def set_pot_values(self, pot_value, pot_value_ps_1=None, pot_value_ps_2=None):
+        """Store the pot values received from the board, returns True if any of them changed."""
+        changed = self.pot_value != pot_value
+        self.pot_value = pot_value
+        if self.node_type in ("phase_beamsplitter", "mach_zehnder"):
+            pot_value_ps_1 = pot_value_ps_1 if pot_value_ps_1 is not None else 0
+            changed = changed or self.pot_value_ps_1 != pot_value_ps_1
+            self.pot_value_ps_1 = pot_value_ps_1
+        if self.node_type == "mach_zehnder":
+            pot_value_ps_2 = pot_value_ps_2 if pot_value_ps_2 is not None else 0
+            changed = changed or self.pot_value_ps_2 != pot_value_ps_2
+            self.pot_value_ps_2 = pot_value_ps_2
+        return changed
+
     def get_output(self, input_brightness_1, input_brightness_2, previous_entanglement1, previous_entanglement2):
         # Initialise output variables
         strip_1_bright = input_brightness_1
@@ -41,7 +70,7 @@ class ESPLED:
         strobe2 = None
 
         # Calculate brightness
-        if self.id == 3:
+        if self.node_type == "phase_beamsplitter":
             T = self.pot_value / 4095
             R = 1 - self.pot_value / 4095
             total_brightness = input_brightness_1 + input_brightness_2
@@ -75,7 +104,7 @@ class ESPLED:
                     self.entanglement = 0
                     entanglement1 = int(self.entanglement)
 
-        elif self.id == 4:
+        elif self.node_type == "mach_zehnder":
             T1, R1 = input_brightness_1/77, (1-(input_brightness_1/77))
             T2, R2 = (self.pot_value / 4095), (1-(self.pot_value / 4095))
             phaseVal1 = (self.pot_value_ps_1 / 4095) * 2 * math.pi
@@ -164,4 +193,4 @@ class ESPLED:
         self.response_data = ",".join("" if v is None else f"{v}" for v in csv_values)
 
     def __repr__(self):
-        return f"ESPLED(id={self.id}, ip={self.ip}, pot_value={self.pot_value}, response_data={self.response_data})"
+        return f"ESPLED(id={self.id}, ip={self.ip}, type={self.node_type}, pot_value={self.pot_value}, response_data={self.response_data})"
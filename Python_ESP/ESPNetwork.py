@@ -0,0 +1,100 @@
+import json
+from ESP32Class import ESPLED
+
+# A topology file describes the light network as a list of nodes:
+#   {"id": 3, "ip": "192.168.4.5", "type": "phase_beamsplitter", "pots": [2000, 2000],
+#    "inputs": [[1, 2], [2, 1]], "entanglement_inputs": [1, 2]}
+# Each of the two inputs is either a constant brightness or [node id, output 1 or 2] of the node
+# feeding it. entanglement_inputs are the ids of the nodes whose entanglement is passed on (0 for
+# none) and default to the nodes of the inputs. pots are the initial pot values.
+
+
+class ESPNetwork:
+    """The ESPs of a topology file, evaluated in topological order.
+
+    update() only recomputes the nodes downstream of the nodes whose pots changed, the outputs of
+    every other node stay valid.
+    """
+
+    def __init__(self, filename):
+        with open(filename) as file:
+            topology = json.load(file)
+        self.esps = {}
+        self.inputs = {}
+        self.entanglement_inputs = {}
+        for node in topology["nodes"]:
+            esp_id = node["id"]
+            if esp_id in self.esps:
+                raise ValueError(f"Duplicate node id {esp_id} in {filename}")
+            self.esps[esp_id] = ESPLED(node["ip"], esp_id, *node.get("pots", [0]), node_type=node.get("type"))
+            inputs = [tuple(source) if isinstance(source, list) else source for source in node["inputs"]]
+            if len(inputs) != 2:
+                raise ValueError(f"Node {esp_id} needs 2 inputs, got {len(inputs)}")
+            self.inputs[esp_id] = inputs
+            self.entanglement_inputs[esp_id] = node.get(
+                "entanglement_inputs", [source[0] if isinstance(source, tuple) else 0 for source in inputs])
+
+        # Nodes that read the outputs or entanglement of each node
+        consumers = {esp_id: [] for esp_id in self.esps}
+        for esp_id in self.esps:
+            for source in self.get_sources(esp_id):
+                if source not in self.esps:
+                    raise ValueError(f"Node {esp_id} reads from unknown node {source}")
+                consumers[source].append(esp_id)
+
+        self.order = self.topological_order(consumers)
+        # Downstream cone of every node (itself included) in evaluation order
+        self.downstream = {}
+        for esp_id in self.esps:
+            cone = {esp_id}
+            stack = [esp_id]
+            while stack:
+                for consumer in consumers[stack.pop()]:
+                    if consumer not in cone:
+                        cone.add(consumer)
+                        stack.append(consumer)
+            self.downstream[esp_id] = [node for node in self.order if node in cone]
+
+    def get_sources(self, esp_id):
+        """Ids of the nodes a node reads from."""
+        sources = {source[0] for source in self.inputs[esp_id] if isinstance(source, tuple)}
+        sources.update(source for source in self.entanglement_inputs[esp_id] if source != 0)
+        return sources
+
+    def topological_order(self, consumers):
+        # Kahn's algorithm, ties are broken by the order of the nodes in the file
+        num_sources = {esp_id: len(self.get_sources(esp_id)) for esp_id in self.esps}
+        ready = [esp_id for esp_id in self.esps if num_sources[esp_id] == 0]
+        order = []
+        while ready:
+            esp_id = ready.pop(0)
+            order.append(esp_id)
+            for consumer in consumers[esp_id]:
+                num_sources[consumer] -= 1
+                if num_sources[consumer] == 0:
+                    ready.append(consumer)
+        if len(order) != len(self.esps):
+            raise ValueError("The topology contains a cycle")
+        return order
+
+    def get_input(self, source):
+        if isinstance(source, tuple):
+            esp_id, output = source
+            return self.esps[esp_id].output_brightness_1 if output == 1 else self.esps[esp_id].output_brightness_2
+        return source
+
+    def update(self, changed=None):
+        """Recompute the nodes downstream of the changed node ids, or every node if changed is None."""
+        if changed is None:
+            nodes = self.order
+        else:
+            affected = set()
+            for esp_id in changed:
+                affected.update(self.downstream[esp_id])
+            nodes = [esp_id for esp_id in self.order if esp_id in affected]
+        for esp_id in nodes:
+            input_1, input_2 = (self.get_input(source) for source in self.inputs[esp_id])
+            entanglement_1, entanglement_2 = (self.esps[source].entanglement if source != 0 else 0
+                                              for source in self.entanglement_inputs[esp_id])
+            self.esps[esp_id].get_output(input_1, input_2, entanglement_1, entanglement_2)
+        return nodes
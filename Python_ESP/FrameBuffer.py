@@ -0,0 +1,26 @@
+from types import MappingProxyType
+
+
+class FrameBuffer:
+    """Hands complete frames of values from one writer thread to reader threads without locks.
+
+    The writer fills back and publish() swaps it to the front with a single reference assignment,
+    which is atomic in Python. A reader keeps the frame it got from read() for as long as it needs,
+    it is read-only and never changes afterwards, because the next back buffer is a fresh copy.
+    """
+
+    def __init__(self, frame=None):
+        self.front = MappingProxyType(dict(frame or {}))
+        self.back = dict(self.front)
+        self.version = 0  # Number of frames published so far
+
+    def publish(self):
+        """Make the back buffer the current frame and start the next one from a copy of it."""
+        frame = self.back
+        self.back = dict(frame)
+        self.front = MappingProxyType(frame)
+        self.version += 1
+
+    def read(self):
+        """The last published frame."""
+        return self.front
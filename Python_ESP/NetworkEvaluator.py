@@ -0,0 +1,153 @@
+from collections import namedtuple
+import numpy as np
+from ESP32Class import NODE_TYPES
+
+# Result of NetworkEvaluator.evaluate, every array has a leading axis over the evaluated states
+NetworkState = namedtuple('NetworkState', [
+    'inputs',             # (states, nodes, 2) input brightness of each node
+    'output_brightness',  # (states, nodes, 2) output_brightness_1 and output_brightness_2
+    'entanglement',       # (states, nodes) entanglement value
+    'phaseshift',         # (states, nodes, 2) rounded phase shifts of strips 1 and 2, nan where the node has none
+])
+
+BEAMSPLITTER = NODE_TYPES.index("beamsplitter")
+PHASE_BEAMSPLITTER = NODE_TYPES.index("phase_beamsplitter")
+MACH_ZEHNDER = NODE_TYPES.index("mach_zehnder")
+
+
+def pure_entanglement(T, R):
+    # Entanglement passed on from an earlier node when one input is dark, 0 where undefined.
+    # float_power rounds like Python's ** in ESPLED, NumPy's ** 2 is a multiplication
+    numerator = np.float_power(np.float_power(T, 2) - np.float_power(R, 2), 2)
+    denominator = numerator + 4 * np.float_power(T, 2) * np.float_power(R, 2)
+    return np.where(denominator != 0, 20 * (numerator / np.where(denominator != 0, denominator, 1)), 0.0)
+
+
+class NetworkEvaluator:
+    """Evaluates every node of an ESPNetwork with NumPy, one layer of independent nodes at a time.
+
+    The node parameters are kept in arrays in topological order and a layer holds the nodes whose
+    sources are all in earlier layers. evaluate() takes pot values with a leading axis over states,
+    so many what-if settings of the network are computed in the same pass. The results are the
+    same as ESPLED.get_output node by node.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.ids = list(network.order)
+        index = {esp_id: i for i, esp_id in enumerate(self.ids)}
+        num_nodes = len(self.ids)
+        self.node_type = np.array([NODE_TYPES.index(network.esps[esp_id].node_type) for esp_id in self.ids])
+
+        # Source of each input: node index and output (0 or 1), or node -1 and a constant brightness
+        self.input_node = np.full((num_nodes, 2), -1)
+        self.input_output = np.zeros((num_nodes, 2), dtype=int)
+        self.input_constant = np.zeros((num_nodes, 2), dtype=int)
+        self.entanglement_node = np.full((num_nodes, 2), -1)
+        level = np.zeros(num_nodes, dtype=int)
+        for i, esp_id in enumerate(self.ids):
+            for k, source in enumerate(network.inputs[esp_id]):
+                if isinstance(source, tuple):
+                    self.input_node[i, k] = index[source[0]]
+                    self.input_output[i, k] = source[1] - 1
+                else:
+                    self.input_constant[i, k] = source
+            for k, source in enumerate(network.entanglement_inputs[esp_id]):
+                if source != 0:
+                    self.entanglement_node[i, k] = index[source]
+            sources = [index[source] for source in network.get_sources(esp_id)]
+            level[i] = 1 + max(level[sources]) if sources else 0
+        self.layers = [np.flatnonzero(level == layer) for layer in range(level.max() + 1 if num_nodes else 0)]
+        self.last_pot_values = np.zeros(num_nodes)  # Used for nodes whose pot value is missing
+
+    def get_pot_arrays(self):
+        """Current pot values of the network as arrays (pot, phase shifter 1, phase shifter 2) in node order.
+
+        A missing phase shifter value counts as 0 like in ESPLED. A missing pot value (e.g. from the
+        packet "1,,,") keeps the last valid value of the node, or 0 before it had one, so one silent
+        board does not hold back the rest of the network.
+        """
+        esps = [self.network.esps[esp_id] for esp_id in self.ids]
+        pot_values = np.array([np.nan if esp.pot_value is None else esp.pot_value for esp in esps], dtype=float)
+        missing = np.isnan(pot_values)
+        pot_values[missing] = self.last_pot_values[missing]
+        self.last_pot_values = pot_values
+        return (pot_values,
+                np.array([getattr(esp, "pot_value_ps_1", 0) or 0 for esp in esps], dtype=float),
+                np.array([getattr(esp, "pot_value_ps_2", 0) or 0 for esp in esps], dtype=float))
+
+    def evaluate(self, pot_values, pot_values_ps_1, pot_values_ps_2):
+        """Evaluate the network for pot value arrays of shape (nodes,) or (states, nodes)."""
+        pot_values, pot_values_ps_1, pot_values_ps_2 = np.broadcast_arrays(
+            *(np.atleast_2d(np.asarray(values, dtype=float)) for values in (pot_values, pot_values_ps_1,
+                                                                              pot_values_ps_2)))
+        num_states, num_nodes = pot_values.shape
+        inputs = np.zeros((num_states, num_nodes, 2), dtype=np.int64)
+        outputs = np.zeros((num_states, num_nodes, 2), dtype=np.int64)
+        entanglement = np.zeros((num_states, num_nodes))
+        phaseshift = np.full((num_states, num_nodes, 2), np.nan)
+
+        for layer in self.layers:
+            node_type = self.node_type[layer]
+            source = np.maximum(self.input_node[layer], 0)
+            in_1, in_2 = np.moveaxis(np.where(self.input_node[layer] >= 0,
+                                              outputs[:, source, self.input_output[layer]],
+                                              self.input_constant[layer]), -1, 0)
+            entanglement_source = np.maximum(self.entanglement_node[layer], 0)
+            previous_1, previous_2 = np.moveaxis(np.where(self.entanglement_node[layer] >= 0,
+                                                          entanglement[:, entanglement_source], 0.0), -1, 0)
+            T = pot_values[:, layer] / 4095
+            R = 1 - pot_values[:, layer] / 4095
+            phase_1 = (pot_values_ps_1[:, layer] / 4095) * 2 * np.pi
+            phase_2 = (pot_values_ps_2[:, layer] / 4095) * 2 * np.pi
+            total = in_1 + in_2
+            is_mach_zehnder = node_type == MACH_ZEHNDER
+            is_phase_beamsplitter = node_type == PHASE_BEAMSPLITTER
+
+            # Mach-Zehnder: the first stage transmission is the brightness of input 1 out of 77
+            T1, R1 = in_1 / 77, (1 - (in_1 / 77))
+            with np.errstate(invalid='ignore'):
+                interference = 2 * np.cos(phase_1 - phase_2) * np.sqrt(T1 * T * R1 * R)
+            first_arm = T1 * T + R1 * R - interference
+            second_arm = T1 * R + R1 * T + interference
+            mach_zehnder_1 = np.trunc((T1 * first_arm + in_2 / 77 * first_arm) * 77)
+            mach_zehnder_2 = np.trunc((T1 * second_arm + in_2 / 77 * second_arm) * 77)
+
+            output_1 = np.where(is_mach_zehnder, mach_zehnder_1, np.trunc(total * T))
+            output_2 = np.select([is_mach_zehnder, is_phase_beamsplitter],
+                                 [mach_zehnder_2, np.trunc(in_1 + in_2 * R)], np.trunc(total * R))
+
+            # Entanglement when both inputs are lit, the phase shifter only enters for the phase types
+            cos_term = np.where(node_type == BEAMSPLITTER, 1.0, 1 + np.cos(phase_1))
+            layer_entanglement = np.where((in_1 != 0) & (in_2 != 0),
+                                          np.round((2 * T * R * cos_term) / (1 + 2 * T * R), 3) * 20, 0.0)
+            passed_on = ((previous_1 != 0) & (in_2 == 0)) | ((previous_2 != 0) & (in_1 == 0))
+            layer_entanglement = np.where(passed_on, pure_entanglement(T, R), layer_entanglement)
+
+            inputs[:, layer, 0] = in_1
+            inputs[:, layer, 1] = in_2
+            outputs[:, layer, 0] = output_1
+            outputs[:, layer, 1] = output_2
+            entanglement[:, layer] = layer_entanglement
+            phaseshift[:, layer, 0] = np.where(is_mach_zehnder, np.round(phase_1, 3), np.nan)
+            phaseshift[:, layer, 1] = np.select([is_mach_zehnder, is_phase_beamsplitter],
+                                                [np.round(phase_2, 3), np.round(phase_1, 3)], np.nan)
+        return NetworkState(inputs, outputs, entanglement, phaseshift)
+
+    def response_data(self, state, node, state_index=0):
+        """CSV reply of a node (index in node order) in the format of ESPLED.response_data."""
+        strips = np.maximum(np.concatenate([state.inputs[state_index, node],
+                                            state.output_brightness[state_index, node]]), 0).tolist()
+        phaseshifts = [None if np.isnan(value) else value for value in state.phaseshift[state_index, node].tolist()]
+        csv_values = strips + phaseshifts + [int(state.entanglement[state_index, node])] + [None] * 5
+        return ",".join("" if v is None else f"{v}" for v in csv_values)
+
+    def update(self):
+        """Evaluate the current pot values and store the results in the ESPLED objects of the network."""
+        state = self.evaluate(*self.get_pot_arrays())
+        for node, esp_id in enumerate(self.ids):
+            esp = self.network.esps[esp_id]
+            esp.output_brightness_1, esp.output_brightness_2 = state.output_brightness[0, node].tolist()
+            esp.entanglement = state.entanglement[0, node].item()
+            esp.response_data = self.response_data(state, node)
+        return state
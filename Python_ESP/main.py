@@ -1,106 +1,159 @@
-import socket
+import argparse
+import asyncio
+import os
+import sys
 import json
+import logging
 import threading
-import time
-from ESP32Class import ESPLED
+from ESPNetwork import ESPNetwork
+from NetworkEvaluator import NetworkEvaluator
+from FrameBuffer import FrameBuffer
+
+# The logging setup is shared with the simulation in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from logger import get_logger, RateLimitFilter
+
+# Per-packet messages are DEBUG, run with QUANTUM_MUSIC_LOG_LEVEL=DEBUG to see them
+log = get_logger("esp_server")
+# Six ESPs send about 50 packets per second each. Only warnings are limited, so DEBUG tracing shows
+# every packet, and warnings with different arguments (e.g. two unknown ids) are limited separately
+log.addFilter(RateLimitFilter(1.0, level=logging.WARNING, by_args=True))
 
 PORT = 80
-channel_1_brightness = 77
-channel_2_brightness = 0
-channel_3_brightness = 77
-channel_4_brightness = 0
-
-# Define ESP instances explicitly
-ESP1 = ESPLED("192.168.4.3", 1, 2000)
-ESP2 = ESPLED("192.168.4.4", 2, 2000)
-ESP3 = ESPLED("192.168.4.5", 3, 2000, 2000)
-ESP4 = ESPLED("192.168.4.6", 4, 2000, 2000, 2000)
-ESP5 = ESPLED("192.168.4.7", 5, 2000)
-ESP6 = ESPLED("192.168.4.8", 6, 2000)
-
-# Dictionary for quick lookup by esp_id
-ESP_MAP = {
-    1: ESP1,
-    2: ESP2,
-    3: ESP3,
-    4: ESP4,
-    5: ESP5,
-    6: ESP6
-}
-
-ALLOWED_IPS = {"192.168.4.3", "192.168.4.4", "192.168.4.5", "192.168.4.6", "192.168.4.7", "192.168.4.8"}
-# Setup udp
-udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+# The ESPs, their IPs, types and wiring are read from a topology file, by default topology.json
+# next to this script. With --vectorised every update evaluates the whole network layer by layer
+# with NumPy, which is faster than recomputing the downstream nodes one by one on large meshes
+parser = argparse.ArgumentParser(description="UDP server computing the light network of the ESPs.")
+parser.add_argument("topology", nargs="?",
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "topology.json"),
+                    help="topology file of the mesh")
+parser.add_argument("--vectorised", action="store_true", help="evaluate the network with NetworkEvaluator")
+args = parser.parse_args()
+
+network = ESPNetwork(args.topology)
+ESP_MAP = network.esps  # Dictionary for quick lookup by esp_id
+ALLOWED_IPS = {ESP.ip for ESP in ESP_MAP.values()}
+evaluator = NetworkEvaluator(network) if args.vectorised else None
+
+# Setup udp, replies to the ESPs are collected and sent together every REPLY_TICK seconds
 udp_port = 1234
+REPLY_TICK = 0.02
 
-print("✅ Waiting for ESP connections...")
+# The logic thread sleeps until update_esp adds the ESP whose pot value changed to dirty_esps,
+# then recomputes only the network downstream of it. With LOGIC_TICK set it also recomputes the
+# whole network every LOGIC_TICK seconds, e.g. for time-dependent effects
+LOGIC_TICK = None
+logic_condition = threading.Condition()
+dirty_esps = set(ESP_MAP)  # Compute everything once at start so every ESP has response data to send
 
-def handle_esps(udp_socket):
-    """Constantly recieves data over udp from esps and updates corresponding class attributes"""
-    while True:
-        data, addr = udp_socket.recvfrom(1024)
-        decoded = data.decode(errors="replace").strip()
-
-        #print(f"📡 Data from {addr}: {decoded}")
-        # Parse CSV: esp_id, p1, p2, p3
-        parts = decoded.split(",")
-        while len(parts) < 4:
-            parts.append("")  # Ensure always 4 values
-
-        esp_id = int(parts[0]) if parts[0] else None
-        p1 = int(parts[1]) if parts[1] else None
-        p2 = int(parts[2]) if parts[2] else None
-        p3 = int(parts[3]) if parts[3] else None
-
-        if esp_id in ESP_MAP:
-            ESP = ESP_MAP[esp_id]
-            ESP.pot_value = p1
-
-            if esp_id == 3:
-                ESP.pot_value_ps_1 = p2 if p2 is not None else 0
-                #print(f"📡 Data from {ESP.response_data}: {decoded}")
-            elif esp_id == 4:
-                ESP.pot_value_ps_1 = p2 if p2 is not None else 0
-                ESP.pot_value_ps_2 = p3 if p3 is not None else 0
-                #print(f"Data from ESP4: {decoded}")
-            udp_socket.sendto((ESP.response_data + "\n").encode(), (ESP.ip, 1234))
-        else:
-            print(f"❌ Unknown esp_id: {esp_id}")
-            continue
-        print(f"📡 Data from ESP2: {ESP2.output_brightness_2}")
-        print(f"📡 Data from ESP3: {ESP3.pot_value/4095, ESP3.entanglement}")
-        #print(f"📡 Data from ESP4: {ESP4.pot_value/4095, ESP4.entanglement}")
-        print(f"📡 Data from ESP5: Decoded: {ESP5.entanglement}")
-        if ESP2.output_brightness_2 == 0 and ESP3.entanglement != 0:
-            print("ESP5 repeated")
-        #print(f"📡 Data from ESP6: {ESP6.response_data}, Decoded: {decoded}, ESP6 Input 1: {ESP4.output_brightness_2} Input 2: {ESP5.output_brightness_1} Output1: {ESP6.output_brightness_1}, Output2: {ESP6.output_brightness_2}")
-    #print(ESP3.response_data)
+# The two threads share no mutable state on their hot paths. The receive side only stores the
+# latest pot values of each ESP as a tuple in received_pots; the logic thread owns the ESPLED
+# objects, applies the pot values to them and publishes the replies of all ESPs as one frame.
+# Every reply tick reads a single complete frame, so no ESP gets a half-updated network
+received_pots = {}
+frames = FrameBuffer()
+
+log.info("✅ Waiting for ESP connections...")
+
+def mark_dirty(esp_id, pots):
+    """Hand new pot values to the logic thread and wake it to recompute the network downstream of the ESP."""
+    with logic_condition:
+        received_pots[esp_id] = pots
+        dirty_esps.add(esp_id)
+        logic_condition.notify()
+
+def parse_packet(data):
+    """Parse the CSV packet esp_id, p1, p2, p3 of an ESP, missing values are None."""
+    parts = data.decode(errors="replace").strip().split(",")
+    while len(parts) < 4:
+        parts.append("")  # Ensure always 4 values
+    return tuple(int(part) if part else None for part in parts[:4])
+
+def update_esp(esp_id, p1, p2, p3):
+    """Pass the pot values of an ESP on to the logic thread if they changed."""
+    pots = (p1, p2, p3)
+    if received_pots.get(esp_id) != pots:
+        mark_dirty(esp_id, pots)
+
+class ESPProtocol(asyncio.DatagramProtocol):
+    """Receives the pot values of the ESPs on the event loop and answers them in batches.
+
+    Every packet only updates the pot values and marks its ESP as waiting for a reply. Once per
+    tick each waiting ESP gets its response data from the latest published frame, so an ESP that
+    sent several packets within one tick is answered once.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.waiting = set()  # ids of the ESPs that sent a packet since the last tick
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            esp_id, p1, p2, p3 = parse_packet(data)
+        except ValueError:
+            log.warning("❌ Malformed packet from %s: %r", addr, data)
+            return
+        if esp_id not in ESP_MAP:
+            log.warning("❌ Unknown esp_id: %s", esp_id)
+            return
+        update_esp(esp_id, p1, p2, p3)
+        self.waiting.add(esp_id)
+        log.debug("📡 Data from ESP%s: %s, %s, %s", esp_id, p1, p2, p3)
+
+    def error_received(self, exc):
+        log.warning("❌ UDP error: %s", exc)
+
+    def send_replies(self):
+        frame = frames.read()  # All replies of this tick come from the same frame
+        for esp_id in self.waiting:
+            response_data = frame.get(esp_id)
+            if response_data is not None:
+                self.transport.sendto((response_data + "\n").encode(), (ESP_MAP[esp_id].ip, udp_port))
+        self.waiting.clear()
+
+async def serve():
+    """Run the UDP server and send the collected replies every REPLY_TICK seconds."""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(ESPProtocol, local_addr=("0.0.0.0", udp_port))
+    try:
+        while True:
+            await asyncio.sleep(REPLY_TICK)
+            protocol.send_replies()
+    finally:
+        transport.close()
 
 def calculate_logic():
-    """Calculates brightness values based on received ESP data."""
+    """Recomputes the network whenever a pot value changed (and every LOGIC_TICK seconds if set)."""
     while True:
+        with logic_condition:
+            logic_condition.wait_for(lambda: dirty_esps, timeout=LOGIC_TICK)
+            changed = set(dirty_esps)
+            dirty_esps.clear()
+            pots = {esp_id: received_pots[esp_id] for esp_id in changed if esp_id in received_pots}
         try:
-            ESP1.get_output(channel_1_brightness, channel_2_brightness, 0, 0)
-            ESP2.get_output(channel_3_brightness, channel_4_brightness, 0, 0)
-            ESP3.get_output(ESP1.output_brightness_2, ESP2.output_brightness_1, ESP1.entanglement, ESP2.entanglement)
-            ESP4.get_output(ESP1.output_brightness_1, ESP3.output_brightness_1, ESP1.entanglement, ESP3.entanglement)
-            ESP5.get_output(ESP3.output_brightness_2, ESP2.output_brightness_2, ESP2.entanglement, ESP3.entanglement)
-            ESP6.get_output(ESP4.output_brightness_2, ESP5.output_brightness_1, ESP4.entanglement, ESP5.entanglement)
-            # (Additional logic for other ESPs can be enabled as needed)
-            time.sleep(0.0001)  # Prevent excessive CPU usage
+            for esp_id, values in pots.items():
+                ESP_MAP[esp_id].set_pot_values(*values)
+            if evaluator is not None:
+                evaluator.update()
+                updated = network.order
+            else:
+                # Without changes the wait timed out on a tick, then everything is recomputed
+                updated = network.update(changed if changed else None)
+            for esp_id in updated:
+                frames.back[esp_id] = ESP_MAP[esp_id].response_data
+            frames.publish()
         except Exception as e:
-            print(f"❌ Error in logic calculation: {e}")
+            log.error("❌ Error in logic calculation: %s", e)
 
-# Start connection handling and logic calculation in separate threads.
-udp_socket.bind(("0.0.0.0", udp_port))
-thread1 = threading.Thread(target=handle_esps, args=(udp_socket,),  daemon=True)
-thread2 = threading.Thread(target=calculate_logic, daemon=True)
-thread1.start()
-thread2.start()
+# Calculate the logic in a separate thread, the UDP server runs on the event loop of the main thread
+logic_thread = threading.Thread(target=calculate_logic, daemon=True)
+logic_thread.start()
 
-# Keep the main thread alive.
 try:
-    while True:
-        time.sleep(0.0001)
+    asyncio.run(serve())
 except KeyboardInterrupt:
-    print("🔚 Shutting down server...")
\ No newline at end of file
+    log.info("🔚 Shutting down server...")
\ No newline at end of file
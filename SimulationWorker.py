@@ -0,0 +1,91 @@
+import logging
+import threading
+from logger import get_logger, RateLimitFilter
+
+log = get_logger(__name__)
+log.addFilter(RateLimitFilter(1.0, level=logging.WARNING))  # A failing simulation would warn on every run
+
+
+class SimulationWorker:
+    """Runs exp_setup.run_experiment in a background thread so the render loop never waits for it.
+
+    The render loop submits the current slider parameters every frame and picks up the latest
+    finished result with get_result(). Only the newest submission is kept, so parameters that
+    arrive while a simulation is running replace each other instead of queueing up.
+    """
+
+    def __init__(self, exp_setup, skip_repeated=True):
+        self.exp_setup = exp_setup
+        # ExperimentalSetupGUIRealError updates itself on a timer, so it has to be called even
+        # when the parameters do not change
+        self.skip_repeated = skip_repeated
+        self.condition = threading.Condition()
+        self.pending_request = None
+        self.last_request = None
+        self.result = None
+        self.result_version = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def submit(self, photon_placement, angle_first_rotation_gates=None, gate_values=None):
+        """Request a simulation with these parameters, replacing any request that has not started yet."""
+        # Copy the parameters, run_experiment consumes gate_values and the sliders keep changing
+        request = (list(photon_placement),
+                   None if angle_first_rotation_gates is None else list(angle_first_rotation_gates),
+                   None if gate_values is None else [tuple(gate_value) for gate_value in gate_values])
+        with self.condition:
+            if self.skip_repeated and request == self.last_request:
+                return
+            self.last_request = request
+            self.pending_request = request
+            self.condition.notify()
+
+    def get_result(self):
+        """Return (version, result) of the latest finished simulation; version increases with every new result."""
+        with self.condition:
+            return self.result_version, self.result
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending_request is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                photon_placement, angle_first_rotation_gates, gate_values = self.pending_request
+                self.pending_request = None
+
+            try:
+                result = self.exp_setup.run_experiment(photon_placement, angle_first_rotation_gates, gate_values)
+            except Exception as e:
+                log.error("Error in simulation worker: %s", e)
+                continue
+
+            with self.condition:
+                # ExperimentalSetupGUIRealError returns the same objects again until its update_interval
+                # has passed, which is not a new result for the render loop
+                if not is_same_result(result, self.result):
+                    self.result = result
+                    self.result_version += 1
+
+
+def is_same_result(result, previous):
+    """Whether result holds the same objects as previous, e.g. a cached (probabilities, states, ...) tuple."""
+    if isinstance(result, tuple) and isinstance(previous, tuple):
+        return len(result) == len(previous) and all(new is old for new, old in zip(result, previous))
+    return result is previous
@@ -0,0 +1,83 @@
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+
+class StageProfiler:
+    """Records the wall time of named stages into a rolling buffer.
+
+    Each record also holds the change in the number of memory blocks allocated by Python during
+    the stage (sys.getallocatedblocks), which is cheap enough to take on every frame and shows
+    stages that leave allocations behind. Stages can be nested, e.g. the simulation inside
+    run_experiment. Only the last capacity records are kept.
+    """
+
+    def __init__(self, capacity=10000):
+        self.records = collections.deque(maxlen=capacity)  # (stage, start, duration, allocated blocks, thread)
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            allocated_blocks = sys.getallocatedblocks() - blocks
+            with self.lock:
+                self.records.append((name, start - self.origin, duration, allocated_blocks, threading.get_ident()))
+
+    def get_records(self, stage=None):
+        with self.lock:
+            records = list(self.records)
+        return [record for record in records if stage is None or record[0] == stage]
+
+    def percentiles(self, percentiles=(50, 90, 99)):
+        """Per stage: number of records, the given percentiles of the duration in ms and the mean allocated blocks."""
+        durations = collections.defaultdict(list)
+        blocks = collections.defaultdict(list)
+        for name, _, duration, allocated_blocks, _ in self.get_records():
+            durations[name].append(duration)
+            blocks[name].append(allocated_blocks)
+        summary = {}
+        for name in durations:
+            values = np.percentile(np.array(durations[name]) * 1e3, percentiles)
+            summary[name] = {"count": len(durations[name]),
+                             **{f"p{p}_ms": float(value) for p, value in zip(percentiles, values)},
+                             "mean_allocated_blocks": float(np.mean(blocks[name]))}
+        return summary
+
+    def report(self):
+        """Text table of percentiles(), one line per stage."""
+        lines = [f"{'stage':20s} {'count':>7s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} {'blocks':>8s}"]
+        for name, stats in self.percentiles().items():
+            lines.append(f"{name:20s} {stats['count']:7d} {stats['p50_ms']:9.3f} {stats['p90_ms']:9.3f} "
+                         f"{stats['p99_ms']:9.3f} {stats['mean_allocated_blocks']:8.1f}")
+        return "\n".join(lines)
+
+    def dump_chrome_trace(self, filename):
+        """Write the buffered stages as a Chrome trace (open in chrome://tracing or ui.perfetto.dev)."""
+        events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": os.getpid(),
+                   "tid": thread, "args": {"allocated_blocks": allocated_blocks}}
+                  for name, start, duration, allocated_blocks, thread in self.get_records()]
+        with open(filename, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+
+_no_stage = contextlib.nullcontext()
+
+
+def profile_stage(profiler, name):
+    """profiler.stage(name), or a context that does nothing when profiling is off (profiler is None)."""
+    return _no_stage if profiler is None else profiler.stage(name)
@@ -0,0 +1,205 @@
+import argparse
+import collections
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+from ExperimentalSetup import ExperimentalSetup
+from ExperimentalSetupGUIReal import ExperimentalSetupGUIReal
+from ExperimentalSetupGUIRealError import ExperimentalSetupGUIRealError
+from DistributionSampler import DistributionSampler
+from StageProfiler import StageProfiler
+from output_states import output_state_tables
+
+# Times every stage of the simulation classes separately for a range of channel and photon
+# numbers and stores the results as JSON, so runs on different commits or machines can be compared:
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+# The stages inside run_experiment (build_program, run_engine, all_fock_probs, extraction,
+# build_unitary, permanents, reduction, ...) are the ones each setup records with its StageProfiler,
+# so they time the code the setup really runs, with or without --reuse-program. Every call gets new
+# gate values, so nothing is reused from the previous call. Enumeration (the output state tables)
+# is the same code for every setup and gets one row with setup "all", sample_counts draws samples
+# from the distribution of the setup with DistributionSampler. Peak memory is measured with
+# tracemalloc in a separate run for the stages timed on their own, the profiled stages report the
+# mean number of memory blocks they leave allocated.
+
+SETUPS = {
+    "ExperimentalSetup": ExperimentalSetup,
+    "ExperimentalSetupGUIReal": ExperimentalSetupGUIReal,
+    "ExperimentalSetupGUIRealError": ExperimentalSetupGUIRealError,
+}
+
+
+def time_function(function, min_time=0.2, max_repeats=50):
+    """Run function after one warm-up call until min_time has passed, returns the list of durations."""
+    function()
+    durations = []
+    start = time.perf_counter()
+    while len(durations) < max_repeats and (not durations or time.perf_counter() - start < min_time):
+        call_start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - call_start)
+    return durations
+
+
+def peak_memory(function):
+    """Peak memory in bytes allocated by Python while function runs."""
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def make_setup(setup_name, m, n, backend, reuse_program=False, profiler=None):
+    kwargs = {"backend": backend, "cache_size": 0, "reuse_program": reuse_program, "profiler": profiler}
+    if setup_name == "ExperimentalSetupGUIRealError":
+        kwargs["update_interval"] = 0  # Simulate on every call instead of returning the last result
+    return SETUPS[setup_name](m, n, **kwargs)
+
+
+def benchmark_setup(setup_name, m, n, backend, reuse_program=False, num_samples=1000, min_time=0.2):
+    """Time run_experiment of a setup and the stages it records, returns a dictionary of stage to results."""
+    profiler = StageProfiler()
+    exp_setup = make_setup(setup_name, m, n, backend, reuse_program, profiler)
+    photon_placement = [1] * n + [0] * (m - n)
+    rng = np.random.default_rng(0)
+    # ExperimentalSetup checks for floor(m^2 / 2) gate values, extra ones are ignored by the mesh
+    settings = [(rng.uniform(0, 2 * np.pi, m).tolist(),
+                 [tuple(values) for values in rng.uniform(0, 2 * np.pi, (m * m // 2, 2)).tolist()])
+                for _ in range(16)]
+    settings = itertools.cycle(settings)
+
+    def run_experiment():
+        angles, gate_values = next(settings)
+        # The fock path of ExperimentalSetup consumes the gate values, so pass a copy every time
+        return exp_setup.run_experiment(photon_placement, list(angles), list(gate_values))
+
+    stages = {"run_experiment": (time_function(run_experiment, min_time), peak_memory(run_experiment), None)}
+    # The records of the warm-up and the tracemalloc runs are left out
+    profiler.clear()
+    time_function(run_experiment, min_time)
+    durations = collections.defaultdict(list)
+    blocks = collections.defaultdict(list)
+    for name, _, duration, allocated_blocks, _ in profiler.get_records():
+        durations[name].append(duration)
+        blocks[name].append(allocated_blocks)
+    for name in durations:
+        stages[name] = (durations[name], None, float(np.mean(blocks[name])))
+
+    probabilities = run_experiment()[0]
+    sampling = lambda: DistributionSampler(probabilities).sample_counts(num_samples)
+    stages["sample_counts"] = (time_function(sampling, min_time), peak_memory(sampling), None)
+    return stages
+
+
+def make_result(setup_name, backend, reuse_program, m, n, stage, durations, peak_memory_bytes, allocated_blocks):
+    result = {
+        "setup": setup_name, "backend": backend, "reuse_program": reuse_program, "m": m, "n": n, "stage": stage,
+        "median_s": statistics.median(durations), "min_s": min(durations), "repeats": len(durations),
+        "peak_memory_bytes": peak_memory_bytes, "mean_allocated_blocks": allocated_blocks,
+    }
+    memory = (f"{peak_memory_bytes / 1024:10.1f} KiB" if peak_memory_bytes is not None
+              else f"{allocated_blocks:10.1f} blocks")
+    print(f"{setup_name:30s} {backend:9s} m={m} n={n} {stage:20s} {result['median_s'] * 1e3:10.3f} ms {memory}")
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(setup_names, backends, channels, max_photons=None, max_fock_size=2 ** 20, num_samples=1000,
+                   min_time=0.2, reuse_program=False):
+    results = []
+    for m in channels:
+        for n in range(1, (m if max_photons is None else min(m, max_photons)) + 1):
+            enumeration = lambda: output_state_tables.__wrapped__(m, n, n + 1)
+            results.append(make_result("all", "all", reuse_program, m, n, "enumeration",
+                                       time_function(enumeration, min_time), peak_memory(enumeration), None))
+            for backend in backends:
+                # The fock backend stores (n + 1)^m amplitudes, larger configurations do not fit in memory
+                if backend == 'fock' and (n + 1) ** m > max_fock_size:
+                    print(f"m={m} n={n} fock: skipped, {(n + 1) ** m} amplitudes exceed --max-fock-size")
+                    continue
+                for setup_name in setup_names:
+                    try:
+                        stages = benchmark_setup(setup_name, m, n, backend, reuse_program, num_samples, min_time)
+                    except Exception as e:
+                        print(f"{setup_name:30s} {backend:9s} m={m} n={n} failed ({e})")
+                        continue
+                    for stage, (durations, peak_memory_bytes, allocated_blocks) in stages.items():
+                        results.append(make_result(setup_name, backend, reuse_program, m, n, stage, durations,
+                                                   peak_memory_bytes, allocated_blocks))
+    return results
+
+
+def result_key(result):
+    return (result["setup"], result["backend"], result.get("reuse_program", False), result["m"], result["n"],
+            result["stage"])
+
+
+def compare(results, baseline_file):
+    """Print the median time of every stage relative to a baseline result file."""
+    with open(baseline_file) as file:
+        baseline = {result_key(result): result for result in json.load(file)["results"]}
+    print(f"\nComparison with {baseline_file} (ratio < 1 is faster)")
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None or previous["median_s"] == 0:
+            continue
+        ratio = result["median_s"] / previous["median_s"]
+        print(f"{result['setup']:30s} {result['backend']:9s} m={result['m']} n={result['n']} "
+              f"{result['stage']:20s} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation classes stage by stage.")
+    parser.add_argument("--setups", nargs="+", default=list(SETUPS), choices=list(SETUPS))
+    parser.add_argument("--backends", nargs="+", default=["fock", "permanent"],
+                        choices=["fock", "permanent", "click"])
+    parser.add_argument("--reuse-program", action="store_true",
+                        help="run the fock backend with programs compiled once (CompiledFockProgram)")
+    parser.add_argument("--min-channels", type=int, default=2)
+    parser.add_argument("--max-channels", type=int, default=8)
+    parser.add_argument("--max-photons", type=int, default=None, help="limit n, by default n goes up to m")
+    parser.add_argument("--max-fock-size", type=int, default=2 ** 20,
+                        help="skip fock runs with more than this many amplitudes")
+    parser.add_argument("--samples", type=int, default=1000, help="samples drawn in the sampling stage")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to repeat each stage for")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.setups, args.backends, range(args.min_channels, args.max_channels + 1),
+                             args.max_photons, args.max_fock_size, args.samples, args.min_time, args.reuse_program)
+    if args.output is not None:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=1)
+        print(f"Saved {len(results)} results to {args.output}")
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
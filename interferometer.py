@@ -0,0 +1,70 @@
+import numpy as np
+
+# The beamsplitter mesh shared by all setups: layer k applies BSgate to the channel pairs
+# (i, i + 1) with i = k % 2, k % 2 + 2, ... Gate values are consumed in that order and the
+# mesh stops early once they run out, exactly like the strawberryfields programs.
+# The GUI setups use m layers (m(m-1)/2 gates), ExperimentalSetup uses m + 1 layers.
+
+
+def mesh_layers(m, num_layers=None):
+    """Upper channel index of every beamsplitter in the mesh, grouped by layer."""
+    if num_layers is None:
+        num_layers = m
+    return [np.arange(layer % 2, m - 1, 2) for layer in range(num_layers)]
+
+
+def calculate_number_of_gates(m, num_layers=None):
+    """Number of beamsplitters in the mesh."""
+    return sum(len(layer) for layer in mesh_layers(m, num_layers))
+
+
+def build_interferometer_batch(angles, gate_values, m, num_layers=None):
+    """Build the mesh unitaries for N parameter sets at once.
+
+    :param angles: array of shape (N, k) with the first rotation gate angles, or (k,) to use
+        the same angles for every set. Missing angles are treated as 0, extra ones are ignored
+    :param gate_values: array of shape (N, G, 2) with (theta, phi) for each beamsplitter
+    :param m: number of channels
+    :param num_layers: number of beamsplitter layers, defaults to m
+    :return: complex array of shape (N, m, m)
+    """
+    gate_values = np.asarray(gate_values, dtype=float)
+    num_sets, num_gates = gate_values.shape[0], gate_values.shape[1]
+
+    angles = np.asarray(angles, dtype=float)
+    if angles.ndim == 1:
+        angles = np.broadcast_to(angles, (num_sets, angles.shape[0]))
+    num_angles = min(angles.shape[1], m)
+
+    # Rgate(phi) multiplies its mode by e^{i phi}, so the rotations form a diagonal unitary
+    phases = np.zeros((num_sets, m))
+    phases[:, :num_angles] = angles[:, :num_angles]
+    unitaries = np.zeros((num_sets, m, m), dtype=complex)
+    unitaries[:, np.arange(m), np.arange(m)] = np.exp(1j * phases)
+
+    # Beamsplitters within a layer act on disjoint channel pairs, so a whole layer is one update
+    gate_index = 0
+    for top in mesh_layers(m, num_layers):
+        if gate_index >= num_gates:
+            break
+        count = min(len(top), num_gates - gate_index)
+        top = top[:count]
+        theta = gate_values[:, gate_index:gate_index + count, 0, np.newaxis]
+        phi = gate_values[:, gate_index:gate_index + count, 1, np.newaxis]
+        gate_index += count
+
+        # BSgate(theta, phi): a -> t a - r* b, b -> r a + t b with t = cos(theta), r = e^{i phi} sin(theta)
+        t = np.cos(theta)
+        r = np.sin(theta) * np.exp(1j * phi)
+        upper = unitaries[:, top]
+        lower = unitaries[:, top + 1]
+        unitaries[:, top] = t * upper - np.conj(r) * lower
+        unitaries[:, top + 1] = r * upper + t * lower
+
+    return unitaries
+
+
+def build_interferometer(angles, gate_values, m, num_layers=None):
+    """Build the m x m unitary of the first rotation gates followed by the beamsplitter mesh."""
+    gate_values = np.asarray(gate_values, dtype=float).reshape(1, -1, 2)
+    return build_interferometer_batch(np.asarray(angles, dtype=float).reshape(1, -1), gate_values, m, num_layers)[0]
@@ -0,0 +1,142 @@
+import collections
+import copy
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+# Shared logging setup for the simulation and the ESP server. Everything logs below the
+# "quantummusic" logger, with the level taken from the QUANTUM_MUSIC_LOG_LEVEL environment
+# variable (INFO by default). The per-run and per-packet messages are DEBUG, and they use
+# %-style arguments, so with verbose output off they are dropped before any string is formatted.
+
+ROOT_NAME = "quantummusic"
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Let each message through at most once per interval seconds.
+
+    Messages are told apart by their logger, source line and unformatted text, so the same warning
+    with changing arguments counts as one message. With by_args the arguments are part of the key
+    as well, e.g. so warnings about different ESP ids are all shown. The next message that passes
+    says how many were suppressed in between. Only records at or above level are limited.
+    """
+
+    def __init__(self, interval=1.0, level=logging.NOTSET, by_args=False, max_keys=1000):
+        super().__init__()
+        self.interval = interval
+        self.level = level  # Records below this level are never limited
+        self.by_args = by_args
+        self.max_keys = max_keys  # Keys older than interval are dropped beyond this many, e.g. from random packets
+        self.last_emitted = {}
+        self.suppressed = collections.Counter()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.lineno, record.msg, repr(record.args) if self.by_args else None)
+        now = time.monotonic()
+        with self.lock:
+            if len(self.last_emitted) > self.max_keys:
+                self.last_emitted = {old_key: last for old_key, last in self.last_emitted.items()
+                                     if now - last < self.interval}
+                self.suppressed = collections.Counter({old_key: count for old_key, count in self.suppressed.items()
+                                                       if old_key in self.last_emitted})
+            last = self.last_emitted.get(key)
+            if last is not None and now - last < self.interval:
+                self.suppressed[key] += 1
+                return False
+            self.last_emitted[key] = now
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+# Argument types that can change after the call, e.g. gate_values is emptied by pop() right after
+# it is logged. The ring buffer keeps shallow copies of them
+MUTABLE_ARGUMENT_TYPES = (list, dict, set, bytearray, np.ndarray)
+
+
+def snapshot_args(args):
+    """Copy of the record arguments that later changes to mutable arguments do not reach."""
+    if isinstance(args, dict):
+        return copy.copy(args)
+    return tuple(copy.copy(arg) if isinstance(arg, MUTABLE_ARGUMENT_TYPES) else arg for arg in args)
+
+
+class RingBufferHandler(logging.Handler):
+    """Keep the last capacity records in memory without formatting them.
+
+    Storing a record costs one tuple append and a shallow copy of the mutable arguments, the text
+    is only built when dump() is called, e.g. after something went wrong on the installation.
+    """
+
+    def __init__(self, capacity=10000, level=logging.NOTSET):
+        super().__init__(level)
+        self.records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append((record.created, record.levelno, record.name, record.msg,
+                             snapshot_args(record.args) if record.args else record.args))
+
+    def dump(self, file=None):
+        """Write the buffered records to file (stderr by default), oldest first."""
+        file = sys.stderr if file is None else file
+        for created, levelno, name, msg, args in list(self.records):
+            message = msg % args if args else msg
+            timestamp = time.strftime("%H:%M:%S", time.localtime(created)) + f".{int(created % 1 * 1000):03d}"
+            file.write(f"{timestamp} {logging.getLevelName(levelno)} {name}: {message}\n")
+
+    def clear(self):
+        self.records.clear()
+
+
+def configure(level=None):
+    """Set up the root logger of the project once; later calls only change the level."""
+    global _configured
+    root = logging.getLogger(ROOT_NAME)
+    with _configure_lock:
+        if not _configured:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+            root.addHandler(handler)
+            root.propagate = False
+            if level is None:
+                level = os.environ.get("QUANTUM_MUSIC_LOG_LEVEL", "INFO").upper()
+            _configured = True
+        if level is not None:
+            root.setLevel(level)
+    return root
+
+
+def get_logger(name):
+    """Logger for a module, e.g. get_logger(__name__)."""
+    configure()
+    return logging.getLogger(f"{ROOT_NAME}.{name}")
+
+
+def set_level(level):
+    """Change the level of every project logger, e.g. set_level("DEBUG") for verbose output."""
+    configure(level)
+
+
+def enable_ring_buffer(capacity=10000, level=logging.DEBUG):
+    """Record every message from level upwards in a RingBufferHandler and return it.
+
+    The project logger level is lowered to level if needed, console output keeps its own level.
+    """
+    root = configure()
+    handler = RingBufferHandler(capacity, level)
+    for existing in root.handlers:
+        if isinstance(existing, logging.StreamHandler) and existing.level == logging.NOTSET:
+            existing.setLevel(root.level)
+    root.addHandler(handler)
+    if root.level > handler.level:
+        root.setLevel(handler.level)
+    return handler
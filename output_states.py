@@ -0,0 +1,130 @@
+import itertools
+import math
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+# Output states are listed in the order the setup classes have always used: from all photons
+# detected down to all photons lost, and for each photon number the distributions over the
+# channels in lexicographic order (the order of itertools.product).
+
+
+def compositions(total, parts):
+    """Yield every way of distributing total photons over parts channels, in lexicographic order."""
+    if parts == 0:
+        if total == 0:
+            yield ()
+        return
+    # Stars and bars: the positions of the parts - 1 bars among total + parts - 1 slots
+    # fix the distribution, and combinations() yields them in lexicographic order
+    slots = total + parts - 1
+    for bars in itertools.combinations(range(slots), parts - 1):
+        previous = -1
+        state = []
+        for bar in bars:
+            state.append(bar - previous - 1)
+            previous = bar
+        state.append(slots - previous - 1)
+        yield tuple(state)
+
+
+def output_state_configurations(num_output_channels, num_photons):
+    """Yield every output state with at most num_photons photons, in the canonical order."""
+    for lost_photons in range(num_photons + 1):
+        yield from compositions(num_photons - lost_photons, num_output_channels)
+
+
+def click_patterns(num_output_channels, num_photons):
+    """On/off detector patterns with at most num_photons clicks, without listing the photon-number states.
+
+    The order is that of output_state_tables(m, n, n + 1).reduced_states: a pattern first appears
+    with the smallest state of n photons that has its support, one photon in every clicking
+    channel and the remaining photons in the last of them. The all-off pattern comes last.
+    """
+    patterns = []
+    for num_clicks in range(1, min(num_photons, num_output_channels) + 1):
+        for channels in itertools.combinations(range(num_output_channels), num_clicks):
+            first_state = [0] * num_output_channels
+            for channel in channels:
+                first_state[channel] = 1
+            first_state[channels[-1]] += num_photons - num_clicks
+            patterns.append((tuple(first_state), tuple(min(1, photons) for photons in first_state)))
+    patterns.sort()
+    return tuple(pattern for _, pattern in patterns) + ((0,) * num_output_channels,)
+
+
+def composition_array(total, parts):
+    """Array of shape (S, parts) with the distributions of compositions(total, parts)."""
+    if parts == 0:
+        return np.zeros((1 if total == 0 else 0, 0), dtype=int)
+    slots = total + parts - 1
+    bars = np.array(list(itertools.combinations(range(slots), parts - 1)), dtype=int)
+    bars = bars.reshape(math.comb(slots, parts - 1), parts - 1)
+    # Pad with virtual bars at -1 and slots, the photons in a channel are the gap between bars
+    padded = np.hstack([np.full((len(bars), 1), -1), bars, np.full((len(bars), 1), slots)])
+    return np.diff(padded, axis=1) - 1
+
+
+def output_state_array(num_output_channels, num_photons):
+    """Array of shape (S, m) with the output states of output_state_configurations."""
+    return np.vstack([composition_array(num_photons - lost_photons, num_output_channels)
+                      for lost_photons in range(num_photons + 1)])
+
+
+def flat_fock_indices(states, dim):
+    """Flat index of each state in a Fock tensor of shape (dim,) * m, or -1 if the state exceeds the cutoff."""
+    states = np.asarray(states, dtype=int)
+    valid = np.all(states < dim, axis=1)
+    indices = np.full(len(states), -1, dtype=np.int64)
+    indices[valid] = np.ravel_multi_index(states[valid].T, (dim,) * states.shape[1])
+    return indices
+
+
+def project_fock_probabilities(fock_probabilities, flat_indices):
+    """Probabilities of the states at flat_indices, read straight from the Fock probability tensor.
+
+    np.take indexes a raveled view of the tensor, so unlike flatten() it never copies all dim^m
+    probabilities.
+    """
+    return np.take(fock_probabilities, flat_indices)
+
+
+OutputStateTables = namedtuple('OutputStateTables', [
+    'states',              # tuple of every output state, in the canonical order
+    'valid',               # boolean mask of the states that fit in the Fock cutoff
+    'valid_states',        # array of shape (V, m) with the states that fit in the Fock cutoff
+    'flat_indices',        # flat Fock-tensor index of each valid state
+    'reduced_states',      # tuple of the reduced configurations, in order of first appearance
+    'reduction_groups',    # index into reduced_states for each valid state
+])
+
+
+@lru_cache(maxsize=None)
+def output_state_tables(num_output_channels, num_photons, dim):
+    """Precompute everything about the output states that does not depend on the gate values.
+
+    The tables are shared between all setups with the same configuration, so the arrays are read-only.
+    """
+    state_array = output_state_array(num_output_channels, num_photons)
+    indices = flat_fock_indices(state_array, dim)
+    valid = indices >= 0
+    valid_states = state_array[valid]
+
+    # Reduce every channel to at most one photon and number the reduced states in order of first appearance
+    reduced = np.minimum(valid_states, 1)
+    unique_reduced, first_index, inverse = np.unique(reduced, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    tables = OutputStateTables(
+        states=tuple(map(tuple, state_array.tolist())),
+        valid=valid,
+        valid_states=valid_states,
+        flat_indices=indices[valid],
+        reduced_states=tuple(map(tuple, unique_reduced[order].tolist())),
+        reduction_groups=rank[inverse.reshape(-1)],
+    )
+    for array in (tables.valid, tables.valid_states, tables.flat_indices, tables.reduction_groups):
+        array.setflags(write=False)
+    return tables
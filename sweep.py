@@ -0,0 +1,180 @@
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from ExperimentalSetup import ExperimentalSetup
+
+# A sweep evaluates ExperimentalSetup.run_experiment on every point of a grid of rotation angles
+# and gate values. The grid is split into chunks of consecutive points that are simulated in
+# separate processes. Each finished chunk is written to <directory>/chunk_<i>.npz with the columns
+# index, parameters and probabilities, and recorded in <directory>/manifest.json, so an interrupted
+# sweep continues with the missing chunks when it is started again with the same arguments.
+# The parameters of a point are the angles followed by the gate values as theta_0, phi_0, theta_1, ...
+
+MANIFEST_NAME = "manifest.json"
+
+
+def calculate_number_of_gates(n):
+    # Number of gate values ExperimentalSetup.run_experiment expects for n channels
+    return math.floor(n * n / 2)
+
+
+def parse_range(text):
+    """Parse start:stop:num (like np.linspace) or a single value into an array of grid values."""
+    parts = text.split(":")
+    if len(parts) == 1:
+        return np.array([float(parts[0])])
+    if len(parts) != 3:
+        raise ValueError(f"Expected start:stop:num or a single value, got {text}")
+    return np.linspace(float(parts[0]), float(parts[1]), int(parts[2]))
+
+
+def chunk_file(directory, chunk_index):
+    return os.path.join(directory, f"chunk_{chunk_index:05d}.npz")
+
+
+# Every worker process builds its setup once and reuses it for all chunks it is given
+_worker_setup = None
+_worker_config = None
+
+
+def init_worker(config):
+    global _worker_setup, _worker_config
+    _worker_config = config
+    _worker_setup = ExperimentalSetup(config["num_output_channels"], config["num_photons"],
+                                      backend=config["backend"], cache_size=0)
+
+
+def run_chunk(chunk_index):
+    """Simulate the grid points of one chunk, returns (chunk_index, indices, parameters, probabilities)."""
+    config = _worker_config
+    grids = [np.asarray(grid) for grid in config["grids"]]
+    shape = tuple(len(grid) for grid in grids)
+    num_angles = config["num_output_channels"]
+    start = chunk_index * config["chunk_size"]
+    indices = np.arange(start, min(start + config["chunk_size"], config["num_points"]))
+
+    grid_indices = np.unravel_index(indices, shape)
+    parameters = np.column_stack([grid[i] for grid, i in zip(grids, grid_indices)])
+    probabilities = []
+    for point in parameters:
+        angles = point[:num_angles].tolist()
+        gate_values = list(zip(point[num_angles::2].tolist(), point[num_angles + 1::2].tolist()))
+        point_probabilities, _ = _worker_setup.run_experiment(config["photon_placement"], angles, gate_values)
+        probabilities.append(point_probabilities)
+    return chunk_index, indices, parameters, np.array(probabilities, dtype=config["dtype"])
+
+
+def write_manifest(directory, manifest):
+    # Write to a temporary file first so an interrupted sweep never leaves a broken manifest
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def run_sweep(directory, num_output_channels, num_photons, photon_placement, grids, backend='fock',
+              chunk_size=256, max_workers=None, dtype='float64'):
+    """Run ExperimentalSetup over the grid in parallel and store the results in directory.
+
+    :param grids: one array of values per parameter, the m angles followed by theta and phi of
+        each gate
+    :param chunk_size: number of grid points simulated and written together
+    :param max_workers: number of processes, defaults to the number of CPUs
+    :return: the manifest of the sweep
+    """
+    num_parameters = num_output_channels + 2 * calculate_number_of_gates(num_output_channels)
+    if len(grids) != num_parameters:
+        raise ValueError(f"Expected {num_parameters} grids ({num_output_channels} angles, theta and phi "
+                         f"for {calculate_number_of_gates(num_output_channels)} gates), got {len(grids)}")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+
+    num_points = int(np.prod([len(grid) for grid in grids]))
+    config = {
+        "num_output_channels": num_output_channels,
+        "num_photons": num_photons,
+        "photon_placement": [int(photon) for photon in photon_placement],
+        "backend": backend,
+        "grids": [np.asarray(grid, dtype=float).tolist() for grid in grids],
+        "chunk_size": chunk_size,
+        "num_points": num_points,
+        "dtype": dtype,
+    }
+    num_chunks = math.ceil(num_points / chunk_size)
+
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest["config"] != config:
+            raise ValueError(f"{directory} holds a sweep with different arguments, use another directory")
+    else:
+        states = ExperimentalSetup(num_output_channels, num_photons).output_tables.states
+        manifest = {"config": config, "num_chunks": num_chunks, "states": [list(state) for state in states],
+                    "completed": []}
+        write_manifest(directory, manifest)
+
+    # A chunk counts as done only if both the manifest entry and its file exist
+    completed = {index for index in manifest["completed"] if os.path.exists(chunk_file(directory, index))}
+    pending = [index for index in range(num_chunks) if index not in completed]
+    print(f"Sweep of {num_points} points in {num_chunks} chunks, {len(pending)} chunks left")
+
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(config,)) as executor:
+        futures = [executor.submit(run_chunk, index) for index in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            chunk_index, indices, parameters, probabilities = future.result()
+            np.savez(chunk_file(directory, chunk_index), index=indices, parameters=parameters,
+                     probabilities=probabilities)
+            completed.add(chunk_index)
+            manifest["completed"] = sorted(completed)
+            write_manifest(directory, manifest)
+            print(f"Chunk {chunk_index} done ({done}/{len(pending)}, {time.time() - start_time:.0f} s)")
+    return manifest
+
+
+def load_sweep(directory):
+    """Read a sweep back, returns (parameters, probabilities, states) ordered by grid index."""
+    with open(os.path.join(directory, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    indices, parameters, probabilities = [], [], []
+    for chunk_index in manifest["completed"]:
+        with np.load(chunk_file(directory, chunk_index)) as chunk:
+            indices.append(chunk["index"])
+            parameters.append(chunk["parameters"])
+            probabilities.append(chunk["probabilities"])
+    if not indices:
+        return np.zeros((0, len(manifest["config"]["grids"]))), np.zeros((0, len(manifest["states"]))), manifest["states"]
+    order = np.argsort(np.concatenate(indices))
+    return np.concatenate(parameters)[order], np.concatenate(probabilities)[order], manifest["states"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep ExperimentalSetup over a grid of angles and gate values.")
+    parser.add_argument("directory", help="output directory, an existing sweep in it is resumed")
+    parser.add_argument("--channels", type=int, default=4, help="number of output channels")
+    parser.add_argument("--photons", type=int, default=3, help="number of photons")
+    parser.add_argument("--input-state", default="1,1,1,0", help="comma separated photon placement")
+    parser.add_argument("--angles", default="0", help="start:stop:num or a value for every rotation angle")
+    parser.add_argument("--thetas", default="0:1.5708:3", help="start:stop:num or a value for every theta")
+    parser.add_argument("--phis", default="0:1.5708:3", help="start:stop:num or a value for every phi")
+    parser.add_argument("--backend", default="fock", choices=["fock", "permanent"])
+    parser.add_argument("--chunk-size", type=int, default=256, help="grid points per chunk file")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: CPU count)")
+    args = parser.parse_args()
+
+    photon_placement = [int(photon) for photon in args.input_state.split(",")]
+    grids = [parse_range(args.angles)] * args.channels
+    for _ in range(calculate_number_of_gates(args.channels)):
+        grids += [parse_range(args.thetas), parse_range(args.phis)]
+    run_sweep(args.directory, args.channels, args.photons, photon_placement, grids, backend=args.backend,
+              chunk_size=args.chunk_size, max_workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import sys
+import numpy as np
+from ExperimentalSetupGUIReal import ExperimentalSetupGUIReal
+from PermanentEngine import PermanentEngine
+from interferometer import build_interferometer, calculate_number_of_gates
+
+# The ESP server modules import each other by their file names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Python_ESP"))
+from ESPNetwork import ESPNetwork
+from NetworkEvaluator import NetworkEvaluator
+
+# Checks that the optimised code paths still agree with the straightforward ones, run with
+#   python testConsistency.py
+# Every check raises an AssertionError with the failing case, otherwise it prints one line.
+
+TOPOLOGY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Python_ESP", "topology.json")
+
+
+def random_gate_values(rng, num_gates):
+    return [tuple(values) for values in rng.uniform(0, 2 * np.pi, (num_gates, 2)).tolist()]
+
+
+def check_cache_hits():
+    """Repeated calls with the same sliders reuse the cached result, even with random rotation angles."""
+    exp_setup = ExperimentalSetupGUIReal(4, 3, backend='permanent')
+    gate_values = [(0.3, 0.1)] * 8
+    for _ in range(5):
+        exp_setup.run_experiment([1, 1, 1, 0], gate_values=gate_values)
+    stats = exp_setup.probability_cache.stats()
+    assert stats["hits"] == 4 and stats["misses"] == 1, stats
+    # Moving a slider is a new key
+    exp_setup.run_experiment([1, 1, 1, 0], gate_values=[(0.4, 0.1)] + gate_values[1:])
+    assert exp_setup.probability_cache.stats()["misses"] == 2, exp_setup.probability_cache.stats()
+    print(f"cache: {stats}")
+
+
+def check_backends(rng, configurations=((2, 1), (3, 2), (4, 2), (4, 3)), num_settings=5, tolerance=1e-12):
+    """The click, permanent and fock backends give the same reduced distribution."""
+    max_difference = 0.0
+    for m, n in configurations:
+        setups = {backend: ExperimentalSetupGUIReal(m, n, backend=backend, cache_size=0)
+                  for backend in ('fock', 'permanent', 'click')}
+        photon_placement = [1] * n + [0] * (m - n)
+        for _ in range(num_settings):
+            angles = rng.uniform(0, 2 * np.pi, m).tolist()
+            gate_values = random_gate_values(rng, calculate_number_of_gates(m))
+            results = {backend: exp_setup.run_experiment(photon_placement, list(angles), list(gate_values))
+                       for backend, exp_setup in setups.items()}
+            fock_probabilities, fock_states = results['fock']
+            for backend in ('permanent', 'click'):
+                probabilities, states = results[backend]
+                assert states == fock_states, (backend, m, n)
+                difference = np.max(np.abs(np.array(probabilities) - fock_probabilities))
+                assert difference < tolerance, (backend, m, n, gate_values, difference)
+                max_difference = max(max_difference, difference)
+    print(f"backends: click and permanent match fock within {max_difference:.1e}")
+
+
+def check_incremental_interferometer(rng, channels=(2, 3, 5, 8), num_updates=2000, tolerance=1e-12):
+    """Moving random sliders one after another gives the same unitary as building it from scratch."""
+    max_difference = 0.0
+    for m in channels:
+        for num_layers in (m, m + 1):
+            engine = PermanentEngine(m, num_layers)
+            num_gates = calculate_number_of_gates(m, num_layers)
+            angles = rng.uniform(0, 2 * np.pi, m)
+            gate_values = rng.uniform(0, 2 * np.pi, (num_gates, 2))
+            for _ in range(num_updates):
+                # One to three sliders at a time, and often new angles as the GUIs draw random ones every call
+                changed = rng.choice(num_gates, size=min(num_gates, rng.integers(1, 4)), replace=False)
+                gate_values[changed] = rng.uniform(0, 2 * np.pi, (len(changed), 2))
+                if rng.random() < 0.5:
+                    angles = rng.uniform(0, 2 * np.pi, m)
+                unitary = engine.build_unitary(angles.tolist(), [tuple(values) for values in gate_values.tolist()])
+                expected = build_interferometer(angles, gate_values, m, num_layers)
+                difference = np.max(np.abs(unitary - expected))
+                assert difference < tolerance, (m, num_layers, difference)
+                max_difference = max(max_difference, difference)
+    print(f"incremental interferometer: matches the full unitary within {max_difference:.1e}")
+
+
+def check_network_evaluator(rng, num_settings=2000):
+    """NetworkEvaluator gives the same replies as ESPLED.get_output node by node, for all settings at once."""
+    network = ESPNetwork(TOPOLOGY_FILE)
+    evaluator = NetworkEvaluator(network)
+    pots = rng.integers(0, 4096, (3, num_settings, len(evaluator.ids)))
+    state = evaluator.evaluate(*pots)
+    for setting in range(num_settings):
+        for node, esp_id in enumerate(evaluator.ids):
+            network.esps[esp_id].set_pot_values(*(int(value) for value in pots[:, setting, node]))
+        network.update()
+        for node, esp_id in enumerate(evaluator.ids):
+            expected = network.esps[esp_id].response_data
+            response_data = evaluator.response_data(state, node, setting)
+            assert response_data == expected, (esp_id, pots[:, setting].tolist(), response_data, expected)
+    print(f"network evaluator: identical replies for {num_settings} random settings")
+
+
+def check_silent_node(rng, num_rounds=200):
+    """A node whose packet has no pot value keeps its last one, the rest of the network still updates."""
+    network = ESPNetwork(TOPOLOGY_FILE)
+    evaluator = NetworkEvaluator(network)
+    reference = ESPNetwork(TOPOLOGY_FILE)
+    for silent in evaluator.ids:
+        for round_index in range(num_rounds):
+            for esp_id in evaluator.ids:
+                pots = [int(value) for value in rng.integers(0, 4096, 3)]
+                if esp_id == silent and round_index > 0:
+                    # The board sends "id,,,", the reference keeps the pot value of the last round
+                    network.esps[esp_id].set_pot_values(None, *pots[1:])
+                    reference.esps[esp_id].set_pot_values(reference.esps[esp_id].pot_value, *pots[1:])
+                else:
+                    network.esps[esp_id].set_pot_values(*pots)
+                    reference.esps[esp_id].set_pot_values(*pots)
+            evaluator.update()
+            reference.update()
+            for esp_id in evaluator.ids:
+                expected = reference.esps[esp_id].response_data
+                assert network.esps[esp_id].response_data == expected, (silent, esp_id, expected)
+    print(f"network evaluator: a silent node keeps its last pot value, {num_rounds} rounds per node")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    check_cache_hits()
+    check_backends(rng)
+    check_incremental_interferometer(rng)
+    check_network_evaluator(rng)
+    check_silent_node(rng)
+
+
+if __name__ == "__main__":
+    main()
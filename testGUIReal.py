@@ -1,9 +1,11 @@
 import pygame
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from ExperimentalSetupGUIReal import ExperimentalSetupGUIReal
+from SimulationWorker import SimulationWorker
+from BarPlot import BarPlot
+from DistributionSampler import DistributionSampler
 import time
+from interferometer import calculate_number_of_gates
 
 # Initialize pygame
 pygame.init()
@@ -25,8 +27,12 @@ num_photons = 3
 input_state = [1,1,1,0]
 exp_setup = ExperimentalSetupGUIReal(num_output_channels=num_channels, num_photons=num_photons)
 
+# Run the simulation in a background thread so dragging a slider never blocks the main loop
+simulation_worker = SimulationWorker(exp_setup)
+simulation_worker.start()
+
 # Initial slider values for gate parameters
-num_gates = num_channels * (num_channels - 1) // 2  # Corresponds to the logic for m layers
+num_gates = calculate_number_of_gates(num_channels)  # Beamsplitters in the m-layer mesh
 gate_values_1 = [0] * num_gates  # First parameter for each gate
 gate_values_2 = [0] * num_gates  # Second parameter for each gate
 
@@ -40,9 +46,7 @@ fade_speed = 20  # How quickly the flash fades out (higher means faster fade)
 
 # Function to sample a state based on the probability distribution
 def sample_state(probs, states):
-    if len(probs) > 0 and np.any(probs):  # Check if probs is non-empty and contains non-zero elements
-        return np.random.choice(len(states), p=probs)
-    return None
+    return DistributionSampler(probs).sample()  # None if probs is empty or all zero
 
 # Function to draw a slider
 def draw_slider(x, y, value, max_value, label):
@@ -53,15 +57,25 @@ def draw_slider(x, y, value, max_value, label):
     screen.blit(label_surface, (x, y - 25))
 
 
+# Bar plot drawn into a pygame surface, created on the first frame
+probability_plot = None
+plot_screen_size = None
+plot_labels = None
+
 # Function to update and display the plot
 def update_plot():
     global last_sample_time, measured_state, flash_alpha
+    global probability_plot, plot_screen_size, plot_labels
 
     # Combine slider values into gate tuples
     gate_values = [(gate_values_1[i], gate_values_2[i]) for i in range(num_gates)]
 
-    # Run the experiment and get probabilities and output states
-    probs, output_states = exp_setup.run_experiment(input_state, gate_values=gate_values)
+    # Hand the current slider values to the worker and use the latest finished simulation
+    simulation_worker.submit(input_state, gate_values=gate_values)
+    _, result = simulation_worker.get_result()
+    if result is None:
+        return  # The first simulation has not finished yet
+    probs, output_states = result
 
     # Normalize probabilities to sum to 1
     if sum(probs) > 0:
@@ -91,27 +105,17 @@ def update_plot():
     # Calculate plot size based on the screen width and height
     plot_width, plot_height = int(width * 0.4), int(height * 0.4)
 
-    # Create a plot
-    fig, ax = plt.subplots(figsize=(plot_width / 140, plot_height / 90))  # Scale figure size to screen size
-    ax.bar(range(len(probs)), probs)
-    ax.set_title("Probabilities of Output States \n channels = %i, photons = %i" % (num_channels, num_photons))
-    ax.set_xlabel("Output States")
-    ax.set_ylabel("Probability")
-
-    # Set x-axis labels to the output states
-    ax.set_xticks(range(len(output_states)))
-    ax.set_xticklabels(output_states_str, rotation='vertical', fontsize=7,
-                       ha='center')  # Rotate and align for better readability
-
-    # Adjust plot layout to ensure labels are fully shown
-    plt.tight_layout()
+    # The figure is built once and only rebuilt when the window size or the states change
+    if probability_plot is None or plot_screen_size != (width, height) or plot_labels != output_states_str:
+        probability_plot = BarPlot(output_states_str, (plot_width / 140, plot_height / 90),  # Scale figure size to screen size
+                                   "Probabilities of Output States \n channels = %i, photons = %i" % (num_channels, num_photons),
+                                   'C0', xlabel="Output States", ylabel="Probability", ylim=(0, 1), title_fontsize=12, label_fontsize=7)
+        plot_screen_size = (width, height)
+        plot_labels = output_states_str
 
     # Render the plot onto the pygame surface
-    canvas = FigureCanvas(fig)
-    canvas.draw()
-    plot_surface = pygame.image.frombuffer(canvas.buffer_rgba().tobytes(), canvas.get_width_height(), "RGBA")
-    screen.blit(plot_surface, (width - plot_width - 310, 20))  # Position plot based on screen width
-    plt.close(fig)
+    probability_plot.update(probs)
+    screen.blit(probability_plot.get_surface(), (width - plot_width - 310, 20))  # Position plot based on screen width
 
     # Draw the measured state on the Pygame screen
     if measured_state is not None:
@@ -193,4 +197,5 @@ while running:
     pygame.display.flip()
 
 # Quit pygame
+simulation_worker.stop()
 pygame.quit()
\ No newline at end of file
@@ -1,9 +1,15 @@
 import pygame
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from ExperimentalSetupGUIReal import ExperimentalSetupGUIReal
+from ProbabilityLookupTable import ProbabilityLookupTable
+from SimulationWorker import SimulationWorker
+from BarPlot import BarPlot
+from PygameBarPlot import PygameBarPlot
+from DistributionSampler import DistributionSampler
+from StageProfiler import StageProfiler, profile_stage
 import time
+from interferometer import calculate_number_of_gates
 from collections import defaultdict
 import socket
 import json
@@ -47,10 +53,26 @@ font = pygame.font.Font('/Users/emmasokoll/Library/Fonts/MinionPro-Regular.otf',
 num_channels = 4  # Adjust as needed
 num_photons = 3
 input_state = [1,1,1,0]
-exp_setup = ExperimentalSetupGUIReal(num_output_channels=num_channels, num_photons=num_photons)
+# Interpolate from a precomputed table instead of simulating, built for this configuration with
+# python ProbabilityLookupTable.py lookup_table --channels 4 --photons 3 --input-state 1,1,1,0 --points N
+# The table has N^12 points for 4 channels and a feasible N leaves it far off between the grid points,
+# so it is refused if its measured interpolation error is above lookup_table_max_error
+use_lookup_table = False
+lookup_table_file = "lookup_table"
+lookup_table_max_error = 0.01
+# Record the time of every simulation stage and frame, press 'P' for a report and a Chrome trace
+profile_stages = False
+profiler = StageProfiler() if profile_stages else None
+if use_lookup_table:
+    exp_setup = ProbabilityLookupTable(lookup_table_file, max_error=lookup_table_max_error)
+    print(f"Using lookup table {lookup_table_file}, max interpolation error {exp_setup.max_error:.4f}")
+else:
+    # The permanent backend rebuilds only the gates changed by a slider
+    exp_setup = ExperimentalSetupGUIReal(num_output_channels=num_channels, num_photons=num_photons, backend='permanent',
+                                         profiler=profiler)
 
 # Initial slider values for gate parameters
-num_gates = num_channels * (num_channels - 1) // 2  # For the number of beam splitter gates
+num_gates = calculate_number_of_gates(num_channels)  # Beamsplitters in the m-layer mesh
 gate_values_1 = [0] * num_gates  # First parameter for each gate
 gate_values_2 = [0] * num_gates  # Second parameter for each gate
 
@@ -70,6 +92,21 @@ output_states = [str(state) for state in initial_output_states]
 for state in output_states:
     state_counts[state] = 0  # Initialize count to zero for each state
 probs = initial_probs  # Store initial probabilities for the smaller plot
+output_states_raw = initial_output_states
+sampler = DistributionSampler(probs)  # Rebuilt only when the worker delivers a new distribution
+sampler_version = 0
+fast_forward_shots = 1000  # Measurements added at once in the demonstration mode
+
+# Bar plots drawn into pygame surfaces, created on the first frame. Native plots are drawn with
+# pygame primitives, otherwise matplotlib renders them (exports always use matplotlib)
+native_plots = True
+histogram_plot = None
+probability_plot = None
+plot_screen_size = None
+
+# Run the simulation in a background thread so dragging a slider never blocks the main loop
+simulation_worker = SimulationWorker(exp_setup)
+simulation_worker.start()
 
 # Variable to track if fullscreen is active
 is_fullscreen = False
@@ -94,11 +131,12 @@ def send_histogram_data(histogram_data, measured_state):
     client_socket.sendto(json_data.encode("utf-8"), server_address)
 
 
-# Function to sample a state based on probabilities
-def sample_state(probs, states):
-    if len(probs) > 0 and np.any(probs):  # Check if probs is non-empty and has non-zero elements
-        return np.random.choice(len(states), p=probs)
-    return None
+# Function to measure many photons at once for the demonstration mode
+def fast_forward(num_shots):
+    counts = sampler.sample_counts(num_shots)
+    for state, count in zip(output_states_raw, counts):
+        state_counts[str(state)] += int(count)
+    print(f"Fast-forwarded {num_shots} measurements")
 
 # Function to draw a slider
 def draw_slider(x, y, value, max_value, label):
@@ -109,20 +147,58 @@ def draw_slider(x, y, value, max_value, label):
     label_surface = font.render(f"{label}: {pi_val:.2f}", True, black)
     screen.blit(label_surface, (x, y - 25))
 
+# Function to create the histogram and probability plots with the given renderer
+def make_plots(plot_class):
+    plot_width, plot_height = int(width * 0.4), int(height * 0.4)
+    small_plot_width, small_plot_height = int(width * 0.2), int(height * 0.2)
+    histogram_plot = plot_class(output_states, (plot_width / 140, plot_height / 90),  # Scale figure size to screen size
+                                "Measurement Counts Over Time \n %i channels, %i photons, input state %s" % (num_channels, num_photons, input_state),
+                                'blue', xlabel="Output States", ylabel="Count")
+    probability_plot = plot_class(output_states, (small_plot_width / 100, small_plot_height / 70),
+                                  "Theoretical Probability Distribution", 'green', ylim=(0, 1))
+    return histogram_plot, probability_plot
+
+# Function to save the current plots as images, always rendered with matplotlib
+def export_plots():
+    counts = [state_counts[state] for state in output_states]
+    export_histogram_plot, export_probability_plot = make_plots(BarPlot)
+    export_histogram_plot.update(counts)
+    export_probability_plot.update(probs)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    export_histogram_plot.save(f"histogram_{timestamp}.png")
+    export_probability_plot.save(f"probabilities_{timestamp}.png")
+    print(f"Saved plots with timestamp {timestamp}")
+
+# Function to print the stage timings and save them as a Chrome trace
+def export_profile():
+    if profiler is None:
+        print("Profiling is off, set profile_stages = True")
+        return
+    print(profiler.report())
+    filename = f"profile_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    profiler.dump_chrome_trace(filename)
+    print(f"Saved Chrome trace to {filename}")
+
 # Function to update and display the plots
 def update_plots():
-    global last_sample_time, measured_state, flash_alpha, state_counts, probs
+    global last_sample_time, measured_state, flash_alpha, state_counts, probs, output_states_raw
+    global sampler, sampler_version, histogram_plot, probability_plot, plot_screen_size
 
     # Combine slider values into gate tuples
     gate_values = [(gate_values_1[i], gate_values_2[i]) for i in range(num_gates)]
 
-    # Update probabilities in real-time
-    probs, output_states_raw = exp_setup.run_experiment(input_state, gate_values=gate_values)
+    # Hand the current slider values to the worker and use the latest finished simulation
+    simulation_worker.submit(input_state, gate_values=gate_values)
+    version, result = simulation_worker.get_result()
+    if result is not None and version != sampler_version:
+        probs, output_states_raw = result
+        sampler = DistributionSampler(probs)  # Built once per distribution, not on every measurement
+        sampler_version = version
 
     # Check if it's time to make a measurement
     if time.time() - last_sample_time >= sampling_interval:
         # Sample a state based on the current probabilities
-        state_index = sample_state(probs, output_states_raw)
+        state_index = sampler.sample()
         if state_index is not None:
             measured_state = str(output_states_raw[state_index])  # Convert to string
             state_counts[measured_state] += 1  # Increment the count for this state
@@ -141,44 +217,20 @@ def update_plots():
 
     # Calculate plot size based on the screen width and height
     plot_width, plot_height = int(width * 0.4), int(height * 0.4)
+    small_plot_width, small_plot_height = int(width * 0.2), int(height * 0.2)
 
-    # Create histogram plot
-    fig, ax = plt.subplots(figsize=(plot_width / 140, plot_height / 90))  # Scale figure size to screen size
-    ax.bar(range(len(counts)), counts, color='blue')
-    ax.set_title("Measurement Counts Over Time \n %i channels, %i photons, input state %s" % (num_channels, num_photons, input_state), fontsize = 15)
-    ax.set_xlabel("Output States")
-    ax.set_ylabel("Count")
-
-    # Set x-axis labels to the output states
-    ax.set_xticks(range(len(output_states)))
-    ax.set_xticklabels(output_states, rotation='vertical', fontsize=10, ha='center')
+    # The plots are built once and only rebuilt when the window size changes
+    if histogram_plot is None or plot_screen_size != (width, height):
+        histogram_plot, probability_plot = make_plots(PygameBarPlot if native_plots else BarPlot)
+        plot_screen_size = (width, height)
 
     # Render the histogram plot onto the pygame surface
-    plt.tight_layout()
-    canvas = FigureCanvas(fig)
-    canvas.draw()
-    plot_surface = pygame.image.frombuffer(canvas.buffer_rgba().tobytes(), canvas.get_width_height(), "RGBA")
-    screen.blit(plot_surface, (width - plot_width - 310, 20))  # Position plot based on screen width
-    plt.close(fig)
-
-    # Create a smaller probability plot
-    small_plot_width, small_plot_height = int(width * 0.2), int(height * 0.2)
-    fig, ax = plt.subplots(figsize=(small_plot_width / 100, small_plot_height / 70))  # Scale figure size to screen size
-    ax.bar(range(len(probs)), probs, color='green')
-    ax.set_ylim(0, 1)
-    ax.set_title("Theoretical Probability Distribution", fontsize=15)
-
-    # Set x-axis labels to the output states
-    ax.set_xticks(range(len(output_states)))
-    ax.set_xticklabels(output_states, rotation='vertical', fontsize=10, ha='center')
-
-    # Render the probability plot onto the pygame surface
-    plt.tight_layout()
-    canvas = FigureCanvas(fig)
-    canvas.draw()
-    small_plot_surface = pygame.image.frombuffer(canvas.buffer_rgba().tobytes(), canvas.get_width_height(), "RGBA")
-    screen.blit(small_plot_surface, (20, height - small_plot_height - 400))  # Position bottom left
-    plt.close(fig)
+    histogram_plot.update(counts)
+    screen.blit(histogram_plot.get_surface(), (width - plot_width - 310, 20))  # Position plot based on screen width
+
+    # Render the smaller probability plot onto the pygame surface
+    probability_plot.update(probs)
+    screen.blit(probability_plot.get_surface(), (20, height - small_plot_height - 400))  # Position bottom left
 
     # Draw the measured state on the Pygame screen
     if measured_state is not None:
@@ -235,7 +287,13 @@ while running:
                 x = max(400, min(700, event.pos[0]))  # Keep the knob within the slider range
                 gate_values_2[dragging_slider_2] = (x - 400) / 300 * np.pi/2
         elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_f:  # Press 'F' to toggle fullscreen
+            if event.key == pygame.K_d:  # Press 'D' to fast-forward the histogram
+                fast_forward(fast_forward_shots)
+            elif event.key == pygame.K_s:  # Press 'S' to save the plots as images
+                export_plots()
+            elif event.key == pygame.K_p:  # Press 'P' to report the stage timings
+                export_profile()
+            elif event.key == pygame.K_f:  # Press 'F' to toggle fullscreen
                 is_fullscreen = not is_fullscreen
                 if is_fullscreen:
                     screen = pygame.display.set_mode((width, height), pygame.FULLSCREEN)
@@ -245,11 +303,13 @@ while running:
                     width, height = screen.get_size()  # Reset width and height
 
     # Update and display the plots
-    update_plots()
+    with profile_stage(profiler, "frame"):
+        update_plots()
 
     # Update the display
     pygame.display.flip()
 
 # Quit pygame
+simulation_worker.stop()
 pygame.quit()
 
@@ -1,9 +1,12 @@
 import pygame
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from ExperimentalSetupGUIRealError import ExperimentalSetupGUIRealError
+from SimulationWorker import SimulationWorker
+from BarPlot import BarPlot
+from PygameBarPlot import PygameBarPlot
+from DistributionSampler import DistributionSampler
 import time
+from interferometer import calculate_number_of_gates
 from collections import defaultdict
 
 # Initialize pygame
@@ -24,10 +27,11 @@ font = pygame.font.Font(None, 36)
 num_channels = 4  # Change this as needed for testing
 num_photons = 3
 input_state = [1,0,1,1]
-exp_setup = ExperimentalSetupGUIRealError(num_output_channels=num_channels, num_photons=num_photons)
+# exact_loss shows the exact lossy distribution instead of one random loss pattern per update
+exp_setup = ExperimentalSetupGUIRealError(num_output_channels=num_channels, num_photons=num_photons, exact_loss=True)
 
 # Initial slider values for gate parameters
-num_gates = num_channels * (num_channels - 1) // 2  # Corresponds to the logic for m layers
+num_gates = calculate_number_of_gates(num_channels)  # Beamsplitters in the m-layer mesh
 gate_values_1 = [0] * num_gates  # First parameter for each gate
 gate_values_2 = [0] * num_gates  # Second parameter for each gate
 
@@ -48,12 +52,29 @@ output_states = [str(state) for state in initial_output_states]  # Convert state
 for state in output_states:
     state_counts[state] = 0  # Initialize each state with a count of zero
 probs = initial_probs  # Store initial probabilities for the smaller plot
-
-# Function to sample a state based on the probability distribution
-def sample_state(probs, states):
-    if len(probs) > 0 and np.any(probs):  # Check if probs is non-empty and contains non-zero elements
-        return np.random.choice(len(states), p=probs)
-    return None
+output_states_raw = initial_output_states
+sampler = DistributionSampler(probs)  # Rebuilt only when the worker delivers a new distribution
+sampler_version = 0
+fast_forward_shots = 1000  # Measurements added at once in the demonstration mode
+
+# Bar plots drawn into pygame surfaces, created on the first frame. Native plots are drawn with
+# pygame primitives, otherwise matplotlib renders them (exports always use matplotlib)
+native_plots = True
+histogram_plot = None
+probability_plot = None
+plot_screen_size = None
+
+# Run the simulation in a background thread so dragging a slider never blocks the main loop.
+# The setup only re-runs every update_interval, so it has to be called even if no slider moved
+simulation_worker = SimulationWorker(exp_setup, skip_repeated=False)
+simulation_worker.start()
+
+# Function to measure many photons at once for the demonstration mode
+def fast_forward(num_shots):
+    counts = sampler.sample_counts(num_shots)
+    for state, count in zip(output_states_raw, counts):
+        state_counts[str(state)] += int(count)
+    print(f"Fast-forwarded {num_shots} measurements")
 
 # Function to draw a slider
 def draw_slider(x, y, value, max_value, label):
@@ -63,19 +84,49 @@ def draw_slider(x, y, value, max_value, label):
     label_surface = font.render(f"{label}: {value:.2f}", True, black)
     screen.blit(label_surface, (x, y - 25))
 
+# Function to create the histogram and probability plots with the given renderer
+def make_plots(plot_class):
+    plot_width, plot_height = int(width * 0.4), int(height * 0.4)
+    small_plot_width, small_plot_height = int(width * 0.2), int(height * 0.2)
+    histogram_plot = plot_class(output_states, (plot_width / 140, plot_height / 90),  # Scale figure size to screen size
+                                "Measurement Counts Over Time \n channels = %i, photons = %i" % (num_channels, num_photons),
+                                'blue', xlabel="Output States", ylabel="Count", title_fontsize=12, label_fontsize=7)
+    probability_plot = plot_class(output_states, (small_plot_width / 140, small_plot_height / 90),
+                                  "Probability Distribution", 'green', ylim=(0, 1), title_fontsize=10, label_fontsize=5)
+    return histogram_plot, probability_plot
+
+# Function to save the current plots as images, always rendered with matplotlib
+def export_plots():
+    counts = [state_counts[state] for state in output_states]
+    export_histogram_plot, export_probability_plot = make_plots(BarPlot)
+    export_histogram_plot.update(counts)
+    export_probability_plot.update(probs)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    export_histogram_plot.save(f"histogram_{timestamp}.png")
+    export_probability_plot.save(f"probabilities_{timestamp}.png")
+    print(f"Saved plots with timestamp {timestamp}")
+
 # Function to update and display the plot
 def update_plot():
-    global last_sample_time, measured_state, flash_alpha, state_counts, probs
+    global last_sample_time, measured_state, flash_alpha, state_counts, probs, output_states_raw
+    global sampler, sampler_version, histogram_plot, probability_plot, plot_screen_size
 
     # Combine slider values into gate tuples
     gate_values = [(gate_values_1[i], gate_values_2[i]) for i in range(num_gates)]
-    probs, output_states_raw, measured_state = exp_setup.run_experiment(input_state, gate_values=gate_values)
+
+    # Hand the current slider values to the worker and use the latest finished simulation
+    simulation_worker.submit(input_state, gate_values=gate_values)
+    version, result = simulation_worker.get_result()
+    if result is not None and version != sampler_version:
+        probs, output_states_raw, measured_state = result
+        sampler = DistributionSampler(probs)  # Built once per distribution, not on every measurement
+        sampler_version = version
 
     # Check if it's time to send in photons and make a measurement
     if time.time() - last_sample_time >= sampling_interval:
 
         # Sample a state based on the current probabilities
-        state_index = sample_state(probs, output_states_raw)
+        state_index = sampler.sample()
         if state_index is not None:
             sampled_state = str(output_states_raw[state_index])  # Convert the measured state to a string
             state_counts[sampled_state] += 1  # Increment the count for this state
@@ -90,46 +141,20 @@ def update_plot():
 
     # Calculate plot size based on the screen width and height
     plot_width, plot_height = int(width * 0.4), int(height * 0.4)
+    small_plot_width, small_plot_height = int(width * 0.2), int(height * 0.2)
 
-    # Create a plot
-    fig, ax = plt.subplots(figsize=(plot_width / 140, plot_height / 90))  # Scale figure size to screen size
-    ax.bar(range(len(counts)), counts, color='blue')
-    ax.set_title("Measurement Counts Over Time \n channels = %i, photons = %i" % (num_channels, num_photons))
-    ax.set_xlabel("Output States")
-    ax.set_ylabel("Count")
-
-    # Set x-axis labels to the output states
-    ax.set_xticks(range(len(output_states)))
-    ax.set_xticklabels(output_states, rotation='vertical', fontsize=7, ha='center')
-
-    # Adjust plot layout to ensure labels are fully shown
-    plt.tight_layout()
+    # The plots are built once and only rebuilt when the window size changes
+    if histogram_plot is None or plot_screen_size != (width, height):
+        histogram_plot, probability_plot = make_plots(PygameBarPlot if native_plots else BarPlot)
+        plot_screen_size = (width, height)
 
-    # Render the plot onto the pygame surface
-    canvas = FigureCanvas(fig)
-    canvas.draw()
-    plot_surface = pygame.image.frombuffer(canvas.buffer_rgba().tobytes(), canvas.get_width_height(), "RGBA")
-    screen.blit(plot_surface, (width - plot_width - 310, 20))  # Position plot based on screen width
-    plt.close(fig)
+    # Render the histogram plot onto the pygame surface
+    histogram_plot.update(counts)
+    screen.blit(histogram_plot.get_surface(), (width - plot_width - 310, 20))  # Position plot based on screen width
 
-    # Create a smaller probability plot
-    small_plot_width, small_plot_height = int(width * 0.2), int(height * 0.2)
-    fig, ax = plt.subplots(figsize=(small_plot_width / 140, small_plot_height / 90))  # Scale figure size to screen size
-    ax.bar(range(len(probs)), probs, color='green')
-    ax.set_ylim(0, 1)
-    ax.set_title("Probability Distribution", fontsize=10)
-
-    # Set x-axis labels to the output states
-    ax.set_xticks(range(len(output_states)))
-    ax.set_xticklabels(output_states, rotation='vertical', fontsize=5, ha='center')
-
-    # Render the probability plot onto the pygame surface
-    plt.tight_layout()
-    canvas = FigureCanvas(fig)
-    canvas.draw()
-    small_plot_surface = pygame.image.frombuffer(canvas.buffer_rgba().tobytes(), canvas.get_width_height(), "RGBA")
-    screen.blit(small_plot_surface, (70, height - small_plot_height - 300))  # Position bottom left
-    plt.close(fig)
+    # Render the smaller probability plot onto the pygame surface
+    probability_plot.update(probs)
+    screen.blit(probability_plot.get_surface(), (70, height - small_plot_height - 300))  # Position bottom left
 
     # Draw the measured state on the Pygame screen
     if measured_state is not None:
@@ -194,7 +219,11 @@ while running:
                 x = max(400, min(700, event.pos[0]))  # Keep the knob within the slider range
                 gate_values_2[dragging_slider_2] = (x - 400) / 300 * 2 * np.pi
         elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_f:  # Press 'F' to toggle fullscreen
+            if event.key == pygame.K_d:  # Press 'D' to fast-forward the histogram
+                fast_forward(fast_forward_shots)
+            elif event.key == pygame.K_s:  # Press 'S' to save the plots as images
+                export_plots()
+            elif event.key == pygame.K_f:  # Press 'F' to toggle fullscreen
                 is_fullscreen = not is_fullscreen
                 if is_fullscreen:
                     screen = pygame.display.set_mode((width, height), pygame.FULLSCREEN)
@@ -210,4 +239,5 @@ while running:
     pygame.display.flip()
 
 # Quit pygame
+simulation_worker.stop()
 pygame.quit()